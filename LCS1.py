@@ -105,3 +105,46 @@ def process_trees(n, trees):
     # 返回 LCS 的长度和路径
     return global_max_length, list(reversed(global_max_path))
 
+
+def multi_lcs(sequences):
+    """
+    Longest common subsequence of k sequences whose elements are distinct
+    within each sequence, such as the segments of tree vectors. Elements that
+    are not in every sequence are pruned by frequency first; a common
+    subsequence is then a chain of elements ordered alike in every sequence,
+    found by dynamic programming over the position index of the remaining
+    elements, in time O(k L + k m^2) for sequences of total length L with m
+    common elements.
+    Input:
+    - sequences (list(list)): k >= 1 sequences of hashable elements
+    Output:
+    - list: a longest common subsequence, in sequence order
+    """
+    # Frequency pruning
+    frequency = {}
+    for sequence in sequences:
+        for x in sequence:
+            frequency[x] = frequency.get(x, 0) + 1
+    k = len(sequences)
+    common = [x for x in sequences[0] if frequency[x] == k]
+    if len(common) <= 1 or k == 1:
+        return common
+    # Position index: positions[i] = positions of common[i] in sequences 1..k-1
+    index = [
+        {x: p for p,x in enumerate(y for y in sequence if frequency[y] == k)}
+        for sequence in sequences[1:]
+    ]
+    positions = [[position[x] for position in index] for x in common]
+    # length[i], previous[i]: longest chain ending with common[i]
+    length, previous = [1] * len(common), [-1] * len(common)
+    for i in range(1,len(common)):
+        pi = positions[i]
+        for h in range(0,i):
+            if length[h] >= length[i] and all(a < b for a,b in zip(positions[h], pi)):
+                length[i], previous[i] = length[h] + 1, h
+    i = max(range(0,len(common)), key=lambda i: length[i])
+    result = []
+    while i >= 0:
+        result.append(common[i])
+        i = previous[i]
+    return result[::-1]
@@ -4,6 +4,8 @@ import ete3
 from ete3 import Tree
 import argparse
 import json
+import profiling
+from cache import TreeCache
 
 def read_file(file_path):
     T1, T2 = "", "" 
@@ -29,20 +31,42 @@ if __name__ == "__main__":
 
     # 添加文件路径参数
     parser.add_argument("file", type=str, help="The path to the file to read")
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Print per-phase timings, counters and histograms as JSON"
+    )
+    parser.add_argument(
+        "--cache-dir", type=str, default=None,
+        help="Directory caching the converted trees across runs"
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=1024,
+        help="Size limit of the cache directory in MB"
+    )
 
     # 解析命令行参数
     args = parser.parse_args()
 
     # 调用读取文件的函数并将内容保存到 T1 和 T2
     T1, id1, T2, id2 = read_file(args.file)
+    if args.profile:
+        profiling.enable()
 
-t1 = Tree(T1)
-t2 = Tree(T2)
+def convert():
+    t1 = Tree(T1)
+    t2 = Tree(T2)
+    return [TreeVec(tree = t1, leaf2idx=id1), TreeVec(tree = t2, leaf2idx=id2)]
 
-tree1 = TreeVec(tree = t1, leaf2idx=id1)
-tree2 = TreeVec(tree = t2, leaf2idx=id2)
+if args.cache_dir is not None:
+    cache = TreeCache(args.cache_dir, max_bytes=args.cache_size << 20)
+    tree1, tree2 = cache.load((T1 + "\n" + T2).encode(), [id1, id2], convert)
+else:
+    tree1, tree2 = convert()
 
 print(tree1.simvec)
 print(tree2.simvec)
 
-print(tree1.hop_similarity(tree2))
\ No newline at end of file
+print(tree1.hop_similarity(tree2))
+
+if args.profile:
+    print(json.dumps(profiling.get_profile(), indent=2))
\ No newline at end of file
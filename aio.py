@@ -0,0 +1,128 @@
+from ete3 import Tree
+from nonbinary import TreeVec
+from treeseq import read_trees
+from batch import chunk_similarities, chunk_distances
+import asyncio
+
+def _convert(newick_str, leaf2idx):
+    return TreeVec(tree=Tree(newick_str, format=1), leaf2idx=leaf2idx)
+
+def _chunk_values(trees, pairs, metric):
+    """
+    Similarities or distances of pairs of trees given by a dict index -> tree,
+    so that only the trees of the chunk are sent to a process executor
+    """
+    if metric == "similarity":
+        return chunk_similarities(trees, pairs)
+    return [chunk_distances(trees, [i], [j])[0][0] for i,j in pairs]
+
+async def convert(newick_str, leaf2idx, executor=None):
+    """
+    Convert a Newick string into a TreeVec without blocking the event loop
+    Input:
+    - newick_str (str): format=1
+    - leaf2idx (dict str -> int)
+    - executor (concurrent.futures.Executor): if None the default executor of
+      the loop
+    Output:
+    - (TreeVec)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _convert, newick_str, leaf2idx)
+
+async def hop_similarity(t1, t2, executor=None):
+    """
+    TreeVec.hop_similarity run in executor (see convert)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, t1.hop_similarity, t2)
+
+async def hop_distance(t1, t2, executor=None):
+    """
+    TreeVec.hop_distance run in executor (see convert)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, t1.hop_distance, t2)
+
+async def compare(trees, pairs, metric="similarity", executor=None, chunksize=16,
+                  max_pending=8):
+    """
+    Compare pairs of trees of a collection in executor, yielding the results as
+    they complete. At most max_pending chunks of pairs are submitted at once,
+    and new chunks are only submitted when results are consumed, so a slow
+    consumer does not accumulate results. Cancelling the consumer or closing
+    the iterator cancels the chunks that have not started.
+    Input:
+    - trees (list(TreeVec))
+    - pairs (iterable((int,int))): pairs of tree indices, read lazily
+    - metric (str): "similarity" or "distance" (see TreeVec.hop_distance)
+    - executor (concurrent.futures.Executor): if None the default executor of
+      the loop; with a process executor, a chunk only sends its own trees
+    - chunksize (int): number of pairs per task
+    - max_pending (int)
+    Output:
+    - async generator of ((int,int),int): (pair, value), in completion order
+    """
+    if metric not in ["similarity", "distance"]:
+        raise ValueError(f"Unknown metric {metric}")
+    loop = asyncio.get_running_loop()
+    pairs = iter(pairs)
+    pending = {}
+
+    def __submit():
+        chunk = [pair for _, pair in zip(range(0,chunksize), pairs)]
+        if not chunk:
+            return False
+        chunk_trees = {i: trees[i] for pair in chunk for i in pair}
+        future = loop.run_in_executor(executor, _chunk_values, chunk_trees, chunk, metric)
+        pending[future] = chunk
+        return True
+
+    try:
+        while len(pending) < max_pending and __submit():
+            pass
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                chunk = pending.pop(future)
+                for pair, value in zip(chunk, future.result()):
+                    yield pair, value
+                __submit()
+    finally:
+        for future in pending:
+            future.cancel()
+
+async def read_treevecs(file_path, leaf2idx, executor=None, max_pending=8):
+    """
+    Read and convert the trees of a file in executor, at most max_pending
+    trees being converted ahead of the consumer
+    Input:
+    - file_path (str): one Newick tree per line
+    - leaf2idx (dict str -> int)
+    - executor, max_pending: see compare
+    Output:
+    - async generator of (TreeVec), in file order
+    """
+    loop = asyncio.get_running_loop()
+    lines = read_trees(file_path)
+    pending = []
+
+    def __next_line():
+        return next(lines, None)
+
+    try:
+        while True:
+            while len(pending) < max_pending:
+                newick_str = await loop.run_in_executor(None, __next_line)
+                if newick_str is None:
+                    break
+                pending.append(
+                    loop.run_in_executor(executor, _convert, newick_str, leaf2idx)
+                )
+            if not pending:
+                break
+            yield await pending.pop(0)
+    finally:
+        for future in pending:
+            future.cancel()
+        lines.close()
@@ -0,0 +1,340 @@
+from ete3 import Tree
+from nonbinary import TreeVec
+from treeseq import read_trees
+from batch import Pool, BACKENDS
+from concurrent.futures import wait, FIRST_COMPLETED
+import numpy as np
+import argparse
+import json
+import os
+
+def distance_dtype(n):
+    """
+    Smallest unsigned integer dtype holding hop distances of trees on n leaves
+    (distances are at most n)
+    """
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if n <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+def metadata_path(path):
+    return path + ".json"
+
+def done_path(path):
+    return path + ".done"
+
+def journal_path(path):
+    return path + ".row.npy"
+
+def read_metadata(path):
+    """
+    Output:
+    - (dict): metadata of the matrix stored at path, None if there is none
+      - num_trees (int): the matrix is num_trees x num_trees
+      - dtype (str)
+      - block_size (int)
+      - done (list([int,int,int,int])): completed blocks [r0,r1,c0,c1], rows r0
+        to r1-1 and columns c0 to c1-1, and their symmetric blocks; read from
+        the append-only log path.done (see append_done)
+      - extend (dict): present during extend_all_pairs, {"from": number of
+        trees before the extension, "row": rows from this one are moved,
+        "journal": row being moved from its copy in path.row.npy, if any}
+    """
+    if not os.path.exists(metadata_path(path)):
+        return None
+    with open(metadata_path(path), 'r', encoding='utf-8') as file:
+        metadata = json.load(file)
+    metadata["done"] = []
+    if os.path.exists(done_path(path)):
+        with open(done_path(path), 'r', encoding='utf-8') as file:
+            for line in file:
+                block = line.split()
+                # A line cut by an interruption is ignored
+                if len(block) == 4 and line.endswith("\n"):
+                    metadata["done"].append([int(x) for x in block])
+    return metadata
+
+def write_metadata(path, metadata):
+    """
+    Write the metadata of a matrix, except the completed blocks, atomically,
+    so that an interrupted run never leaves a partial checkpoint
+    """
+    tmp_path = metadata_path(path) + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump({key: value for key, value in metadata.items() if key != "done"}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, metadata_path(path))
+
+def write_done(path, blocks):
+    """
+    Replace the log of completed blocks of a matrix, atomically
+    """
+    tmp_path = done_path(path) + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        for r0,r1,c0,c1 in blocks:
+            file.write(f"{r0} {r1} {c0} {c1}\n")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, done_path(path))
+
+def append_done(path, block):
+    """
+    Checkpoint a completed block by appending it to the log of the matrix, in
+    constant time whatever the number of blocks already done
+    """
+    with open(done_path(path), 'a', encoding='utf-8') as file:
+        file.write("%d %d %d %d\n" % tuple(block))
+        file.flush()
+        os.fsync(file.fileno())
+
+def open_matrix(path, mode="r"):
+    """
+    Open a stored distance matrix as a memmap
+    Input:
+    - path (str): raw matrix file, with metadata in path.json
+    - mode (str): numpy.memmap mode
+    Output:
+    - (numpy.memmap)
+    """
+    metadata = read_metadata(path)
+    N = metadata["num_trees"]
+    return np.memmap(path, dtype=metadata["dtype"], mode=mode, shape=(N,N))
+
+# Number of rows moved between two checkpoints when extending a matrix
+EXTEND_CHECKPOINT_ROWS = 1024
+
+def _blocks(rows, cols, block_size):
+    """
+    Rectangular blocks [r0,r1,c0,c1] covering the upper part of rows x cols
+    of a symmetric matrix, by chunks of block_size indices starting at the
+    first index of each range; a block is skipped if its symmetric block is
+    listed
+    """
+    row_starts = range(rows.start, rows.stop, block_size)
+    col_starts = range(cols.start, cols.stop, block_size)
+    return [
+        [r0, min(r0+block_size, rows.stop), c0, min(c0+block_size, cols.stop)]
+        for r0 in row_starts for c0 in col_starts
+        if rows != cols or r0 <= c0
+    ]
+
+def _complete(metadata):
+    """
+    Output:
+    - (bool): True if the completed blocks cover the whole matrix; blocks do
+      not overlap and diagonal blocks cover their upper part only
+    """
+    covered = 0
+    for r0,r1,c0,c1 in metadata["done"]:
+        if r0 == c0:
+            covered += (r1-r0) * (r1-r0+1) // 2
+        else:
+            covered += (r1-r0) * (c1-c0)
+    N = metadata["num_trees"]
+    return covered == N * (N+1) // 2
+
+def _fill(trees, path, metadata, blocks, processes, backend):
+    """
+    Compute the blocks of the matrix stored at path that are not listed in
+    metadata["done"], checkpointing every completed block
+    """
+    matrix = open_matrix(path, mode="r+")
+    # Rewriting the log once drops a line cut by an interruption
+    write_done(path, metadata["done"])
+    done = {tuple(block) for block in metadata["done"]}
+    todo = iter([block for block in blocks if tuple(block) not in done])
+    with Pool(trees, processes=processes, backend=backend) as pool:
+        # At most 2 blocks per worker are pending, to bound memory
+        pending = {}
+        while True:
+            for block in todo:
+                r0,r1,c0,c1 = block
+                pending[pool.distances(range(r0,r1), range(c0,c1))] = block
+                if len(pending) >= 2*pool.processes:
+                    break
+            if not pending:
+                break
+            completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                r0,r1,c0,c1 = pending.pop(future)
+                block = np.array(future.result(), dtype=matrix.dtype)
+                matrix[r0:r1, c0:c1] = block
+                matrix[c0:c1, r0:r1] = block.T
+                matrix.flush()
+                metadata["done"].append([r0,r1,c0,c1])
+                append_done(path, [r0,r1,c0,c1])
+    del matrix
+    return open_matrix(path)
+
+def all_pairs(trees, path, block_size=256, processes=None, backend="process",
+              overwrite=False):
+    """
+    Compute the matrix of pairwise hop distances of a collection of trees into
+    a memmapped file, by square blocks of block_size x block_size trees
+    (symmetric blocks are computed once). Completed blocks are checkpointed
+    in path.done, and a run on an existing path with the same number of trees
+    and block size only computes the missing blocks.
+    Input:
+    - trees (list(TreeVec) or SharedTreeCollection): trees on the same leaves
+    - path (str): raw matrix file, row-major, dtype from distance_dtype
+    - block_size (int)
+    - processes (int), backend (str): see batch.Pool
+    - overwrite (bool): if True, a matrix at path with another number of trees
+      or block size is recomputed from scratch; if False, ValueError is raised
+    Output:
+    - (numpy.memmap): the matrix, opened read-only
+    """
+    N = len(trees)
+    metadata = read_metadata(path)
+    if metadata is not None and "extend" in metadata:
+        raise ValueError(f"{path} is being extended, resume with extend_all_pairs")
+    if metadata is not None and not overwrite:
+        if metadata["num_trees"] != N:
+            raise ValueError(
+                f"{path} holds the matrix of {metadata['num_trees']} trees, not {N}: "
+                "use extend_all_pairs to add trees, or overwrite=True to recompute it"
+            )
+        if metadata["block_size"] != block_size:
+            raise ValueError(
+                f"{path} was computed with block size {metadata['block_size']}, "
+                f"not {block_size}: use overwrite=True to recompute it"
+            )
+    if (
+            metadata is None or metadata["num_trees"] != N
+            or metadata["block_size"] != block_size
+    ):
+        n = sum(1 for x in trees[0].vector if x[3]) if N > 0 else 0
+        metadata = {
+            "num_trees": N, "dtype": distance_dtype(n).name,
+            "block_size": block_size, "done": []
+        }
+        matrix = np.memmap(path, dtype=metadata["dtype"], mode="w+", shape=(N,N))
+        matrix.flush()
+        del matrix
+        write_done(path, [])
+        write_metadata(path, metadata)
+    if _complete(metadata):
+        return open_matrix(path)
+    blocks = _blocks(range(0,N), range(0,N), block_size)
+    return _fill(trees, path, metadata, blocks, processes, backend)
+
+def extend_all_pairs(trees, path, processes=None, backend="process"):
+    """
+    Grow a matrix computed by all_pairs for the first trees of a collection to
+    the whole collection. The file is extended in place: rows are moved to
+    their new position from the last one, then only the distances between new
+    and old trees and between new trees are computed. The move and the new
+    blocks are checkpointed, so an interrupted extension can be resumed by
+    calling extend_all_pairs again with the same trees.
+    Input:
+    - trees (list(TreeVec) or SharedTreeCollection): the trees of the stored
+      matrix, in the same order, followed by the new trees
+    - path (str): matrix file
+    - processes (int), backend (str): see batch.Pool
+    Output:
+    - (numpy.memmap): the matrix, opened read-only
+    """
+    metadata = read_metadata(path)
+    N, block_size = len(trees), metadata["block_size"]
+    dtype = np.dtype(metadata["dtype"])
+    if "extend" not in metadata:
+        N_old = metadata["num_trees"]
+        if N < N_old:
+            raise ValueError(f"{N} trees given for a matrix on {N_old} trees")
+        if not _complete(metadata):
+            raise ValueError(f"{path} is incomplete, run all_pairs first")
+        if N == N_old:
+            return open_matrix(path)
+        n = max(sum(1 for x in trees[i].vector if x[3]) for i in range(N_old,N))
+        if distance_dtype(n).itemsize > dtype.itemsize:
+            raise ValueError(f"distances on {n} leaves do not fit in {dtype.name}")
+        metadata["extend"] = {"from": N_old, "row": N_old}
+        write_metadata(path, metadata)
+        with open(path, 'r+b') as file:
+            file.truncate(N*N*dtype.itemsize)
+    N_old, row = metadata["extend"]["from"], metadata["extend"]["row"]
+    # Moving old rows from the last one: row i moves from i*N_old to i*N, so
+    # its source is never overwritten by the move of a row j > i, and a move can
+    # be done again after an interruption, except for rows overlapping their own
+    # destination (i*N < (i+1)*N_old): they are copied to a journal before the
+    # move, which is redone from the journal after an interruption
+    flat = np.memmap(path, dtype=dtype, mode="r+", shape=(N*N,))
+
+    def __checkpoint(i):
+        flat.flush()
+        metadata["extend"]["row"] = i
+        metadata["extend"].pop("journal", None)
+        write_metadata(path, metadata)
+
+    if "journal" in metadata["extend"]:
+        row = metadata["extend"]["journal"]
+        flat[row*N:row*N+N_old] = np.load(journal_path(path))
+        __checkpoint(row)
+    for i in range(row-1, 0, -1):
+        if i*N < (i+1)*N_old:
+            source = np.array(flat[i*N_old:(i+1)*N_old])
+            with open(journal_path(path), 'wb') as file:
+                np.save(file, source)
+                file.flush()
+                os.fsync(file.fileno())
+            metadata["extend"]["journal"] = i
+            write_metadata(path, metadata)
+            flat[i*N:i*N+N_old] = source
+            __checkpoint(i)
+        else:
+            flat[i*N:i*N+N_old] = flat[i*N_old:(i+1)*N_old]
+            if i % EXTEND_CHECKPOINT_ROWS == 0:
+                __checkpoint(i)
+    flat.flush()
+    if os.path.exists(journal_path(path)):
+        os.remove(journal_path(path))
+    del flat
+    metadata["extend"]["row"] = 0
+    metadata["num_trees"] = N
+    write_metadata(path, metadata)
+    blocks = (
+        _blocks(range(0,N_old), range(N_old,N), block_size)
+        + _blocks(range(N_old,N), range(N_old,N), block_size)
+    )
+    _fill(trees, path, metadata, blocks, processes, backend)
+    del metadata["extend"]
+    write_metadata(path, metadata)
+    return open_matrix(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Resumable all-pairs hop distance matrix of a tree collection"
+    )
+    parser.add_argument("file", type=str, help="File with one Newick tree per line")
+    parser.add_argument("leaf2idx", type=str, help="JSON file: leaf name -> index (1-base)")
+    parser.add_argument("output", type=str, help="Matrix file (metadata in OUTPUT.json)")
+    parser.add_argument("--block-size", type=int, default=256)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--backend", type=str, default="process", choices=BACKENDS)
+    parser.add_argument(
+        "--extend", action="store_true",
+        help="OUTPUT holds the matrix of the first trees of FILE: compute the new rows"
+    )
+    parser.add_argument(
+        "--overwrite", action="store_true",
+        help="Recompute OUTPUT if it holds another number of trees or block size"
+    )
+    args = parser.parse_args()
+
+    with open(args.leaf2idx, 'r', encoding='utf-8') as file:
+        leaf2idx = json.load(file)
+    trees = [
+        TreeVec(tree=Tree(newick_str, format=1), leaf2idx=leaf2idx)
+        for newick_str in read_trees(args.file)
+    ]
+    if args.extend:
+        extend_all_pairs(
+            trees, args.output, processes=args.processes, backend=args.backend
+        )
+    else:
+        all_pairs(
+            trees, args.output, block_size=args.block_size,
+            processes=args.processes, backend=args.backend, overwrite=args.overwrite
+        )
@@ -0,0 +1,261 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from shared import SharedTreeCollection, vector_segments, segments_similarity
+import os
+
+# Executors of the batch comparison functions
+BACKENDS = ["process", "thread"]
+
+# Trees of the current worker process, set by _init_worker
+_TREES = None
+
+def _init_worker(trees):
+    global _TREES
+    _TREES = trees
+
+def _segments(trees, i):
+    """
+    Output:
+    - list(list(tuple(int))): segments of tree i of a collection (see
+      shared.vector_segments), read from the shared arrays if it is a
+      SharedTreeCollection
+    """
+    if isinstance(trees, (SharedTreeCollection, _WithQuery)):
+        return trees.segments(i)
+    return vector_segments(trees[i].vector)
+
+def chunk_similarities(trees, pairs):
+    """
+    Hop similarities of pairs of trees of a collection, computed in the
+    current thread (task of a worker), the segments of each tree being read
+    from the collection once per call
+    Input:
+    - trees (list(TreeVec), SharedTreeCollection, or dict int -> TreeVec)
+    - pairs (list((int,int))): pairs of tree indices
+    Output:
+    - list(int)
+    """
+    cache = {}
+
+    def __tree(i):
+        if i not in cache:
+            cache[i] = _segments(trees, i)
+        return cache[i]
+
+    return [segments_similarity(__tree(i), __tree(j)) for i,j in pairs]
+
+def chunk_distances(trees, rows, cols):
+    """
+    Hop distances (see TreeVec.hop_distance) between two ranges of trees of a
+    collection, the segments of each tree being read from the collection once
+    per call and each unordered pair compared once, in the current thread
+    Input:
+    - trees (list(TreeVec), SharedTreeCollection, or dict int -> TreeVec)
+    - rows, cols (iterable(int)): tree indices
+    Output:
+    - list(list(int)): distances[i][j] = distance between rows[i] and cols[j]
+    """
+    cache, internal, computed = {}, {}, {}
+
+    def __tree(i):
+        if i not in cache:
+            cache[i] = _segments(trees, i)
+            internal[i] = sum(len(segment) for segment in cache[i])
+        return cache[i]
+
+    def __distance(i, j):
+        if i == j:
+            return 0
+        if (j,i) not in computed:
+            computed[(i,j)] = (
+                max(internal[i], internal[j])
+                - segments_similarity(__tree(i), __tree(j))
+            )
+            return computed[(i,j)]
+        return computed[(j,i)]
+
+    for i in list(rows) + list(cols):
+        __tree(i)
+    return [[__distance(i,j) for j in cols] for i in rows]
+
+def _worker_similarities(pairs):
+    return chunk_similarities(_TREES, pairs)
+
+def _worker_distances(rows, cols):
+    return chunk_distances(_TREES, rows, cols)
+
+class Pool:
+    """
+    Workers comparing trees of a collection. With the process backend, the
+    collection is sent once to every worker when it starts (by name for a
+    SharedTreeCollection); with the thread backend it is shared without copy.
+    Trees of a SharedTreeCollection are compared from the shared arrays
+    without being decoded into TreeVec objects, and are not kept by the
+    workers between tasks.
+    """
+
+    def __init__(self, trees, processes=None, backend="process"):
+        """
+        Input:
+        - trees (list(TreeVec) or SharedTreeCollection)
+        - processes (int): number of workers, if None os.cpu_count()
+        - backend (str): in BACKENDS
+        """
+        if processes is None:
+            processes = os.cpu_count() or 1
+        self.trees = trees
+        self.processes = processes
+        self.backend = backend
+        if backend == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=processes)
+        elif backend == "process":
+            self.executor = ProcessPoolExecutor(
+                max_workers=processes, initializer=_init_worker, initargs=(trees,)
+            )
+        else:
+            raise ValueError(f"Unknown backend {backend}")
+
+    def similarities(self, pairs):
+        """
+        Output:
+        - (Future): list(int), hop similarities of pairs of tree indices
+        """
+        if self.backend == "thread":
+            return self.executor.submit(chunk_similarities, self.trees, pairs)
+        return self.executor.submit(_worker_similarities, pairs)
+
+    def distances(self, rows, cols):
+        """
+        Output:
+        - (Future): list(list(int)), hop distances between the trees of two
+          ranges of indices (see chunk_distances)
+        """
+        if self.backend == "thread":
+            return self.executor.submit(chunk_distances, self.trees, rows, cols)
+        return self.executor.submit(_worker_distances, rows, cols)
+
+    def shutdown(self, cancel_futures=False):
+        self.executor.shutdown(cancel_futures=cancel_futures)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+def hop_similarities(trees, pairs, processes=None, chunksize=None, backend="process"):
+    """
+    Compute the hop similarities of pairs of trees of a collection
+    Input:
+    - trees (list(TreeVec) or SharedTreeCollection): trees on the same leaves
+      order; with the process backend, a SharedTreeCollection is attached to by
+      name by the workers and a list is pickled once per worker
+    - pairs (list((int,int))): pairs of tree indices
+    - processes (int): number of workers, if None os.cpu_count(); if 1,
+      computed in the current thread
+    - chunksize (int): number of pairs per task, if None about 4 tasks per
+      worker
+    - backend (str): in BACKENDS; "thread" shares the trees between the
+      workers without copy, which scales on free-threaded Python builds
+    Output:
+    - list(int): similarity of every pair, in the order of pairs
+    """
+    pairs = list(pairs)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1 or len(pairs) <= 1:
+        return chunk_similarities(trees, pairs)
+    if chunksize is None:
+        chunksize = max(1, len(pairs) // (4*processes))
+    result = []
+    with Pool(trees, processes=processes, backend=backend) as pool:
+        futures = [
+            pool.similarities(pairs[i:i+chunksize])
+            for i in range(0,len(pairs),chunksize)
+        ]
+        for future in futures:
+            result += future.result()
+    return result
+
+def hop_distances(trees, rows, cols, processes=None, chunksize=None, backend="process"):
+    """
+    Compute the hop distances (see TreeVec.hop_distance) between two ranges of
+    trees of a collection
+    Input:
+    - trees (list(TreeVec) or SharedTreeCollection)
+    - rows, cols (iterable(int)): tree indices
+    - processes, backend: see hop_similarities
+    - chunksize (int): number of rows per task, if None about 4 tasks per
+      worker
+    Output:
+    - list(list(int)): distances[i][j] = distance between rows[i] and cols[j]
+    """
+    rows, cols = list(rows), list(cols)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1 or len(rows) <= 1:
+        return chunk_distances(trees, rows, cols)
+    if chunksize is None:
+        chunksize = max(1, len(rows) // (4*processes))
+    result = []
+    with Pool(trees, processes=processes, backend=backend) as pool:
+        futures = [
+            pool.distances(rows[i:i+chunksize], cols)
+            for i in range(0,len(rows),chunksize)
+        ]
+        for future in futures:
+            result += future.result()
+    return result
+
+def hop_similarity_matrix(trees, processes=None, chunksize=None, backend="process"):
+    """
+    Compute the matrix of pairwise hop similarities of a collection of trees
+    Input:
+    - trees (list(TreeVec) or SharedTreeCollection)
+    - processes, chunksize, backend: see hop_similarities
+    Output:
+    - list(list(int)): symmetric matrix
+    """
+    N = len(trees)
+    pairs = [(i,j) for i in range(0,N) for j in range(i,N)]
+    similarities = hop_similarities(
+        trees, pairs, processes=processes, chunksize=chunksize, backend=backend
+    )
+    matrix = [[0] * N for _ in range(0,N)]
+    for (i,j),similarity in zip(pairs, similarities):
+        matrix[i][j] = matrix[j][i] = similarity
+    return matrix
+
+def one_vs_many(tree, trees, processes=None, chunksize=None, backend="process"):
+    """
+    Compute the hop similarities of a tree to every tree of a collection
+    Input:
+    - tree (TreeVec)
+    - trees (list(TreeVec) or SharedTreeCollection)
+    - processes, chunksize, backend: see hop_similarities
+    Output:
+    - list(int)
+    """
+    N = len(trees)
+    pairs = [(-1,j) for j in range(0,N)]
+    return hop_similarities(
+        _WithQuery(tree, trees), pairs, processes=processes, chunksize=chunksize,
+        backend=backend
+    )
+
+class _WithQuery:
+    """
+    Collection of trees extended with a query tree at index -1
+    """
+
+    def __init__(self, tree, trees):
+        self.tree = tree
+        self.trees = trees
+
+    def __len__(self):
+        return len(self.trees)
+
+    def __getitem__(self, i):
+        return self.tree if i == -1 else self.trees[i]
+
+    def segments(self, i):
+        return vector_segments(self.tree.vector) if i == -1 else _segments(self.trees, i)
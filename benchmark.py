@@ -0,0 +1,279 @@
+from ete3 import Tree
+from LIS import LIS_len, LIS_seq
+from LCS1 import process_trees
+import batch
+import argparse
+import importlib
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+# Tree shapes
+SHAPES = ["caterpillar", "balanced", "random", "polytomy"]
+# Implementations of TreeVec that can be benchmarked; the variants other than
+# nonbinary fail on treevec2tree, and on hop_similarity for nonbinary1_3 or for
+# trees with different numbers of internal nodes (errors are recorded)
+VARIANTS = ["nonbinary", "nonbinary11_1", "nonbinary12_20", "nonbinary1_3"]
+# Operations
+OPERATIONS = [
+    "tree2treevec", "treevec2tree", "hop_similarity", "hop_similarity_seq",
+    "LIS_len", "LIS_seq", "process_trees", "batch_process", "batch_thread"
+]
+# Number of trees of the collections compared by the batch operations
+BATCH_SIZE = 8
+# Largest number of leaves an operation is run on, for super-linear operations
+# (process_trees is about cubic in the segment size: 10 s per call on a
+# 1000-leaf caterpillar)
+MAX_LEAVES = {"process_trees": 200}
+
+def make_tree(shape, n, rng, max_degree=10):
+    """
+    Generate a tree with n leaves named L1 to Ln, placed in random order,
+    without recursion so that deep trees can be built
+    Input:
+    - shape (str): in SHAPES
+      - caterpillar: every internal node has a leaf child
+      - balanced: complete binary tree when n is a power of 2
+      - random: random binary tree obtained by joining random pairs of subtrees
+      - polytomy: as random, joining between 2 and max_degree subtrees
+    - n (int): number of leaves, n >= 2
+    - rng (random.Random)
+    - max_degree (int)
+    Output:
+    - (Tree): branch lengths are random
+    """
+    leaves = [Tree(name=f"L{i}", dist=rng.random()) for i in range(1,n+1)]
+    rng.shuffle(leaves)
+
+    def __join(subtrees):
+        node = Tree(dist=rng.random())
+        for subtree in subtrees:
+            node.add_child(subtree)
+        return node
+
+    if shape == "caterpillar":
+        tree = leaves[0]
+        for leaf in leaves[1:]:
+            tree = __join([tree, leaf])
+    elif shape == "balanced":
+        level = leaves
+        while len(level) > 1:
+            level = [
+                __join(level[i:i+2]) if i+1 < len(level) else level[i]
+                for i in range(0,len(level),2)
+            ]
+        tree = level[0]
+    elif shape in ["random", "polytomy"]:
+        pool = leaves
+        while len(pool) > 1:
+            k = 2 if shape == "random" else rng.randint(2, min(max_degree,len(pool)))
+            subtrees = []
+            for _ in range(0,k):
+                # removing a random subtree from the pool in constant time
+                i = rng.randrange(len(pool))
+                pool[i], pool[-1] = pool[-1], pool[i]
+                subtrees.append(pool.pop())
+            pool.append(__join(subtrees))
+        tree = pool[0]
+    else:
+        raise ValueError(f"Unknown shape {shape}")
+    tree.dist = 0.0
+    return tree
+
+def segment_pairs(treevec1, treevec2):
+    """
+    Pairs of per-leaf segments of two vectors relabeled as in hop_similarity:
+    the first segment is relabeled 0,1,... and the second accordingly,
+    excluding labels absent from the first one
+    Output:
+    - list((list(int),list(int)))
+    """
+    def __segments(v):
+        segments, segment = [], []
+        for x in v:
+            if x[3]:
+                segments.append(segment)
+                segment = []
+            else:
+                segment.append(frozenset(x[0]))
+        return segments
+
+    pairs = []
+    for segment1, segment2 in zip(
+            __segments(treevec1.vector), __segments(treevec2.vector)
+    ):
+        map1 = {segment1[i]: i for i in range(0,len(segment1))}
+        relabeled = [map1[x] for x in segment2 if x in map1]
+        if relabeled:
+            pairs.append((list(range(0,len(segment1))), relabeled))
+    return pairs
+
+def measure(setup, function, repeats, memory):
+    """
+    Time a function and optionally measure its peak memory allocation
+    Input:
+    - setup: callable with no argument, not measured, whose result is the
+      argument of function
+    - function: callable with one argument
+    - repeats (int): number of timed calls
+    - memory (bool): if True, one additional call is traced with tracemalloc
+    Output:
+    - (dict): {"time_s": minimum time, "peak_bytes": peak allocation or None}
+    """
+    times = []
+    for _ in range(0,repeats):
+        x = setup()
+        start = time.perf_counter()
+        function(x)
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        x = setup()
+        tracemalloc.start()
+        function(x)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"time_s": min(times), "peak_bytes": peak}
+
+def gil_enabled():
+    """
+    Output:
+    - (bool): False on a free-threaded Python build running without the GIL
+    """
+    return getattr(sys, "_is_gil_enabled", lambda: True)()
+
+def operation_functions(module, operation, newick, leaf2idx, treevec1, treevec2):
+    """
+    Setup and measured functions of an operation (see measure)
+    Input:
+    - module: module defining TreeVec
+    - operation (str): in OPERATIONS
+    - newick (str): Newick string of the first tree
+    - leaf2idx (dict str -> int)
+    - treevec1, treevec2 (module.TreeVec)
+    Output:
+    - (callable,callable)
+    """
+    no_setup = lambda: None
+    if operation == "tree2treevec":
+        # Parsing is not measured; every call gets a fresh tree as the
+        # legacy tree2treevec variants modify their input (nonbinary does not)
+        return (
+            lambda: Tree(newick, format=1),
+            lambda tree: module.TreeVec(tree=tree, leaf2idx=leaf2idx)
+        )
+    if operation == "treevec2tree":
+        return no_setup, lambda _: treevec1.treevec2tree()
+    if operation == "hop_similarity":
+        return no_setup, lambda _: treevec1.hop_similarity(treevec2)
+    if operation == "hop_similarity_seq":
+        return no_setup, lambda _: treevec1.hop_similarity(treevec2, compute_seq=True)
+    if operation in ["batch_process", "batch_thread"]:
+        # all-pairs similarities of a collection with os.cpu_count() workers
+        trees = [treevec1, treevec2] * (BATCH_SIZE // 2)
+        backend = operation.split("_")[1]
+        return no_setup, lambda _: batch.hop_similarity_matrix(trees, backend=backend)
+    pairs = segment_pairs(treevec1, treevec2)
+    if operation == "LIS_len":
+        return no_setup, lambda _: [LIS_len(s2) for s1,s2 in pairs]
+    if operation == "LIS_seq":
+        return no_setup, lambda _: [LIS_seq(s2) for s1,s2 in pairs]
+    if operation == "process_trees":
+        return no_setup, lambda _: [process_trees(2, [s1, s2]) for s1,s2 in pairs]
+    raise ValueError(f"Unknown operation {operation}")
+
+def run(sizes, shapes, variants, operations, repeats=3, memory=True, seed=0):
+    """
+    Run the benchmark; every configuration uses its own random generator seeded
+    from seed, shape and size, so results are reproducible
+    Output:
+    - list(dict): one record per (shape, size, variant, operation) with keys
+      shape, n, variant, operation, time_s, peak_bytes, error, skipped
+      (reason why the operation was not run, or None)
+    """
+    results = []
+    for shape in shapes:
+        for n in sizes:
+            rng = random.Random(f"{seed}:{shape}:{n}")
+            tree1, tree2 = make_tree(shape, n, rng), make_tree(shape, n, rng)
+            leaf2idx = {f"L{i}": i for i in range(1,n+1)}
+            newick1 = tree1.write(format=1)
+            newick2 = tree2.write(format=1)
+            for variant in variants:
+                module = importlib.import_module(variant)
+                treevec1 = treevec2 = None
+                for operation in operations:
+                    record = {
+                        "shape": shape, "n": n, "variant": variant,
+                        "operation": operation, "time_s": None,
+                        "peak_bytes": None, "error": None, "skipped": None
+                    }
+                    if variant != "nonbinary" and operation in [
+                            "LIS_len", "LIS_seq", "process_trees",
+                            "batch_process", "batch_thread"
+                    ]:
+                        continue
+                    if n > MAX_LEAVES.get(operation, n):
+                        record["skipped"] = f"more than {MAX_LEAVES[operation]} leaves"
+                        results.append(record)
+                        continue
+                    try:
+                        if treevec1 is None:
+                            treevec1 = module.TreeVec(
+                                tree=Tree(newick1, format=1), leaf2idx=leaf2idx
+                            )
+                            treevec2 = module.TreeVec(
+                                tree=Tree(newick2, format=1), leaf2idx=leaf2idx
+                            )
+                        setup, function = operation_functions(
+                            module, operation, newick1, leaf2idx, treevec1, treevec2
+                        )
+                        record.update(measure(setup, function, repeats, memory))
+                    except Exception as e:
+                        record["error"] = f"{type(e).__name__}: {e}"
+                    results.append(record)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark tree conversion, decoding and hop similarity"
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+        help="Numbers of leaves (up to 10^6)"
+    )
+    parser.add_argument("--shapes", type=str, nargs="+", default=SHAPES, choices=SHAPES)
+    parser.add_argument(
+        "--variants", type=str, nargs="+", default=["nonbinary"], choices=VARIANTS
+    )
+    parser.add_argument(
+        "--operations", type=str, nargs="+", default=OPERATIONS, choices=OPERATIONS
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=str, default=None, help="JSON output file (default: stdout)"
+    )
+    args = parser.parse_args()
+
+    results = run(
+        args.sizes, args.shapes, args.variants, args.operations,
+        repeats=args.repeats, memory=not args.no_memory, seed=args.seed
+    )
+    report = {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "gil_enabled": gil_enabled(),
+        "seed": args.seed,
+        "repeats": args.repeats,
+        "results": results
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,135 @@
+from ete3 import Tree
+from nonbinary import TreeVec
+from hashlib import sha256
+import json
+import os
+import pickle
+
+# Version of the pickled TreeVec layout, to increase when the attributes of
+# TreeVec change so that older entries are ignored
+FORMAT_VERSION = 2
+
+class TreeCache:
+    """
+    Directory of converted tree vectors, keyed by a hash of the input content
+    and of the leaf orders, so a file is parsed once across runs. Entries are
+    pickled lists of TreeVec, tagged with FORMAT_VERSION; the least recently used entries are removed when
+    the directory exceeds its size limit (use is recorded in the file
+    modification time).
+
+    Data structure
+    - directory (str)
+    - max_bytes (int): size limit, None for no limit
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(content, leaf2idx):
+        """
+        Input:
+        - content (bytes): input file content
+        - leaf2idx: leaf orders used for the conversion, JSON serializable
+        Output:
+        - (str): hexadecimal digest, depending on FORMAT_VERSION
+        """
+        h = sha256(f"v{FORMAT_VERSION}\n".encode())
+        h.update(content)
+        h.update(json.dumps(leaf2idx, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key):
+        """
+        Output:
+        - list(TreeVec): None if the entry is not in the cache, or cannot be
+          loaded (corrupted, or written by another version)
+        """
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as file:
+                version, treevecs = pickle.load(file)
+        except Exception:
+            # missing entry, unpickling error, or classes that no longer match
+            return None
+        if version != FORMAT_VERSION:
+            return None
+        os.utime(path)
+        return treevecs
+
+    def put(self, key, treevecs):
+        """
+        Store an entry atomically, then evict entries if needed
+        """
+        path = self.__path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            pickle.dump((FORMAT_VERSION, treevecs), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the directory fits in
+        max_bytes
+        """
+        if self.max_bytes is None:
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def load(self, content, leaf2idx, convert):
+        """
+        Converted vectors of an input, from the cache or computed and stored
+        Input:
+        - content (bytes), leaf2idx: see key
+        - convert (function): () -> list(TreeVec), called on a miss
+        Output:
+        - list(TreeVec)
+        """
+        key = self.key(content, leaf2idx)
+        treevecs = self.get(key)
+        if treevecs is None:
+            treevecs = convert()
+            self.put(key, treevecs)
+        return treevecs
+
+def load_trees(file_path, leaf2idx, cache=None):
+    """
+    Convert the trees of a file, one Newick string per line, through a cache
+    Input:
+    - file_path (str)
+    - leaf2idx (dict str -> int)
+    - cache (TreeCache): if None, no cache
+    Output:
+    - list(TreeVec)
+    """
+    with open(file_path, 'rb') as file:
+        content = file.read()
+
+    def __convert():
+        return [
+            TreeVec(tree=Tree(line, format=1), leaf2idx=leaf2idx)
+            for line in content.decode('utf-8').splitlines() if line.strip()
+        ]
+
+    if cache is None:
+        return __convert()
+    return cache.load(content, leaf2idx, __convert)
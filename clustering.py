@@ -0,0 +1,174 @@
+from batch import hop_distances
+import numpy as np
+import random
+
+class DistanceCache:
+    """
+    Hop distances between trees of a collection, computed on demand and kept
+    for later requests
+
+    Data structure
+    - trees (list(TreeVec) or SharedTreeCollection)
+    - distances (dict (int,int) -> int): (i,j) -> distance, i < j
+    - processes (int), backend (str): see batch.hop_distances
+    """
+
+    def __init__(self, trees, processes=1, backend="process"):
+        self.trees = trees
+        self.processes = processes
+        self.backend = backend
+        self.distances = {}
+
+    def matrix(self, rows, cols):
+        """
+        Distances between two lists of tree indices; only the missing distances
+        are computed, in parallel
+        Output:
+        - (numpy.ndarray): len(rows) x len(cols)
+        """
+        rows, cols = list(rows), list(cols)
+        missing = [
+            i for i in rows
+            if any(i != j and (min(i,j),max(i,j)) not in self.distances for j in cols)
+        ]
+        if missing:
+            computed = hop_distances(
+                self.trees, missing, cols, processes=self.processes,
+                backend=self.backend
+            )
+            for i, row in zip(missing, computed):
+                for j, d in zip(cols, row):
+                    if i != j:
+                        self.distances[(min(i,j),max(i,j))] = d
+        return np.array([
+            [0 if i == j else self.distances[(min(i,j),max(i,j))] for j in cols]
+            for i in rows
+        ], dtype=np.int64).reshape(len(rows), len(cols))
+
+def _build(D, k):
+    """
+    Greedy initialization of PAM: each medoid is the point that most reduces
+    the total distance to the medoids already chosen
+    """
+    medoids = [int(np.argmin(D.sum(axis=1)))]
+    nearest = D[medoids[0]].copy()
+    while len(medoids) < k:
+        gains = np.maximum(nearest[None,:] - D, 0).sum(axis=1)
+        gains[medoids] = -1
+        m = int(np.argmax(gains))
+        medoids.append(m)
+        nearest = np.minimum(nearest, D[m])
+    return medoids
+
+def fasterpam(D, k, max_iter=100):
+    """
+    k-medoids of a distance matrix by FasterPAM (Schubert and Rousseeuw, 2021):
+    from a greedy initialization, every non-medoid is tried in turn and swapped
+    with the medoid whose replacement decreases the total distance the most,
+    each candidate being evaluated in O(n) from the distances to the nearest
+    and second nearest medoids
+    Input:
+    - D (numpy.ndarray): n x n symmetric distance matrix
+    - k (int): number of medoids, at most n
+    - max_iter (int): maximum number of passes over the candidates
+    Output:
+    - (list(int),numpy.ndarray,int): medoids, index in medoids of the medoid
+      of every point, total distance of the points to their medoid
+    """
+    n = D.shape[0]
+    medoids = _build(D, k)
+    if k == 1:
+        return medoids, np.zeros(n, dtype=np.int64), int(D[medoids[0]].sum())
+
+    def __assign():
+        M = D[medoids]
+        order = np.argsort(M, axis=0, kind="stable")
+        nearest, second = order[0], order[1]
+        cols = np.arange(n)
+        return nearest, M[nearest,cols], M[second,cols]
+
+    def __removal_loss(nearest, dn, ds):
+        return np.bincount(nearest, weights=ds-dn, minlength=k)
+
+    nearest, dn, ds = __assign()
+    loss = __removal_loss(nearest, dn, ds)
+    last_swap = None
+    for _ in range(0,max_iter):
+        swapped = False
+        for xc in range(0,n):
+            if xc == last_swap:
+                # A full pass without improvement since the last swap
+                return medoids, nearest, int(dn.sum())
+            if xc in medoids:
+                continue
+            d = D[xc]
+            delta = loss.copy()
+            closer = d < dn
+            accumulated = float(np.sum(d[closer] - dn[closer]))
+            np.add.at(delta, nearest[closer], (dn-ds)[closer])
+            between = ~closer & (d < ds)
+            np.add.at(delta, nearest[between], (d-ds)[between])
+            m = int(np.argmin(delta))
+            if delta[m] + accumulated < 0:
+                medoids[m] = xc
+                nearest, dn, ds = __assign()
+                loss = __removal_loss(nearest, dn, ds)
+                last_swap = xc
+                swapped = True
+        if not swapped:
+            break
+    return medoids, nearest, int(dn.sum())
+
+def kmedoids(trees, k, samples=5, sample_size=None, seed=None, processes=1,
+             backend="process", cache=None):
+    """
+    k-medoids clustering of a collection of trees under the hop distance, by
+    CLARA: FasterPAM is run on the distance matrix of random samples of the
+    collection, every tree is assigned to its nearest medoid, and the medoids
+    with the smallest total distance are kept. Costs about
+    samples x (sample_size^2/2 + len(trees) x k) comparisons instead of
+    len(trees)^2/2; distances are cached, so medoids found again are not
+    compared twice.
+    Input:
+    - trees (list(TreeVec) or SharedTreeCollection): trees on the same leaves
+    - k (int): number of clusters
+    - samples (int): number of samples
+    - sample_size (int): if None 40+2k; if at least len(trees), one run of
+      FasterPAM on the whole collection
+    - seed: seed of the random generator
+    - processes (int), backend (str): see batch.hop_distances, used for the
+      sample matrices and the assignment steps
+    - cache (DistanceCache): distances already computed, if None a new cache
+    Output:
+    - (dict):
+      - medoids (list(int)): indices of the medoid trees
+      - medoid_trees (list(TreeVec))
+      - labels (list(int)): index in medoids of the cluster of every tree
+      - cost (int): total distance of the trees to their medoid
+    """
+    N = len(trees)
+    k = min(k, N)
+    rng = random.Random(seed)
+    if cache is None:
+        cache = DistanceCache(trees, processes=processes, backend=backend)
+    if sample_size is None:
+        sample_size = 40 + 2*k
+    if sample_size >= N:
+        samples, sample_size = 1, N
+    best = None
+    for _ in range(0,samples):
+        sample = sorted(rng.sample(range(0,N), sample_size))
+        medoids, _, _ = fasterpam(cache.matrix(sample, sample), k)
+        medoids = [sample[m] for m in medoids]
+        D = cache.matrix(range(0,N), medoids)
+        labels = np.argmin(D, axis=1)
+        cost = int(D[np.arange(N),labels].sum())
+        if best is None or cost < best[2]:
+            best = (medoids, labels, cost)
+    medoids, labels, cost = best
+    return {
+        "medoids": medoids,
+        "medoid_trees": [trees[m] for m in medoids],
+        "labels": [int(c) for c in labels],
+        "cost": cost
+    }
@@ -0,0 +1,192 @@
+from ete3 import Tree
+from nonbinary import TreeVec
+from treeseq import read_trees
+from batch import hop_distances
+import numpy as np
+import argparse
+import json
+import random
+
+def select_landmarks(trees, num_landmarks, method="maxmin", seed=None, processes=1):
+    """
+    Select landmark trees in a collection
+    Input:
+    - trees (list(TreeVec))
+    - num_landmarks (int)
+    - method (str):
+      - random: uniform sample
+      - maxmin: starting from a random tree, the next landmark is the tree
+        with the largest hop distance to the landmarks already selected;
+        costs num_landmarks x len(trees) comparisons
+    - seed: seed of the random generator
+    - processes (int): see batch.hop_distances
+    Output:
+    - list(int): indices of the landmarks in trees
+    """
+    rng = random.Random(seed)
+    N = len(trees)
+    num_landmarks = min(num_landmarks, N)
+    if method == "random":
+        return rng.sample(range(0,N), num_landmarks)
+    if method != "maxmin":
+        raise ValueError(f"Unknown landmark selection method {method}")
+    landmarks = [rng.randrange(N)]
+    min_distance = [None] * N
+    while len(landmarks) < num_landmarks:
+        distances = hop_distances(
+            trees, range(0,N), [landmarks[-1]], processes=processes
+        )
+        for i in range(0,N):
+            if min_distance[i] is None or distances[i][0] < min_distance[i]:
+                min_distance[i] = distances[i][0]
+        landmarks.append(max(range(0,N), key=lambda i: min_distance[i]))
+    return landmarks
+
+class LandmarkMDS:
+    """
+    Landmark multidimensional scaling of hop distances: classical MDS of the
+    landmark trees, then every tree is placed by triangulation from its hop
+    distances to the landmarks only, so embedding N trees costs N x L
+    comparisons for L landmarks.
+
+    Data structure
+    - landmarks (list(TreeVec))
+    - dimensions (int): number of coordinates, at most the number of positive
+      eigenvalues of the landmark MDS
+    - eigenvalues (numpy.ndarray): kept eigenvalues, decreasing
+    - landmark_coordinates (numpy.ndarray): L x dimensions
+    - pseudo_inverse (numpy.ndarray): dimensions x L, rows v_i/sqrt(lambda_i)
+    - mean_squared (numpy.ndarray): L, column means of squared landmark
+      distances
+    """
+
+    def __init__(self, landmarks, dimensions=2, processes=1, backend="process"):
+        """
+        Compute the MDS of the landmarks
+        Input:
+        - landmarks (list(TreeVec)): trees on the same leaves order
+        - dimensions (int)
+        - processes (int), backend (str): see batch.hop_distances
+        """
+        self.landmarks = list(landmarks)
+        self.processes = processes
+        self.backend = backend
+        L = len(self.landmarks)
+        D = np.array(hop_distances(
+            self.landmarks, range(0,L), range(0,L),
+            processes=processes, backend=backend
+        ), dtype=float)
+        squared = D ** 2
+        self.mean_squared = squared.mean(axis=0)
+        # Double centering
+        J = np.eye(L) - np.ones((L,L)) / L
+        B = -0.5 * J @ squared @ J
+        eigenvalues, eigenvectors = np.linalg.eigh(B)
+        order = np.argsort(eigenvalues)[::-1]
+        eigenvalues, eigenvectors = eigenvalues[order], eigenvectors[:,order]
+        positive = int(np.sum(eigenvalues > 1e-9 * max(1.0, eigenvalues[0])))
+        self.dimensions = min(dimensions, positive)
+        self.eigenvalues = eigenvalues[:self.dimensions]
+        vectors = eigenvectors[:,:self.dimensions]
+        self.landmark_coordinates = vectors * np.sqrt(self.eigenvalues)
+        self.pseudo_inverse = (vectors / np.sqrt(self.eigenvalues)).T
+
+    def transform(self, trees):
+        """
+        Coordinates of trees
+        Input:
+        - trees (list(TreeVec)): trees on the leaves order of the landmarks
+        Output:
+        - (numpy.ndarray): len(trees) x dimensions
+        """
+        trees = list(trees)
+        L = len(self.landmarks)
+        combined = self.landmarks + trees
+        D = np.array(hop_distances(
+            combined, range(L,len(combined)), range(0,L),
+            processes=self.processes, backend=self.backend
+        ), dtype=float).reshape(len(trees), L)
+        return -0.5 * (D ** 2 - self.mean_squared) @ self.pseudo_inverse.T
+
+    def transform_stream(self, trees, batch_size=1024):
+        """
+        Coordinates of a stream of trees, computed by batches
+        Input:
+        - trees (iterable(TreeVec))
+        - batch_size (int)
+        Output:
+        - generator of (numpy.ndarray): coordinates of every tree, in order
+        """
+        batch = []
+        for tree in trees:
+            batch.append(tree)
+            if len(batch) == batch_size:
+                yield from self.transform(batch)
+                batch = []
+        if batch:
+            yield from self.transform(batch)
+
+def reservoir_sample(items, k, seed=None):
+    """
+    Uniform sample of k items of an iterable read once, in O(k) memory
+    Output:
+    - list
+    """
+    rng = random.Random(seed)
+    sample = []
+    for i, item in enumerate(items):
+        if i < k:
+            sample.append(item)
+        else:
+            j = rng.randrange(i+1)
+            if j < k:
+                sample[j] = item
+    return sample
+
+def embed_file(file_path, leaf2idx, num_landmarks=50, dimensions=2,
+               seed=None, processes=1, batch_size=1024):
+    """
+    Embed the trees of a file in two passes with bounded memory: landmarks are
+    sampled without parsing the other trees, then the trees are embedded by
+    batches
+    Input:
+    - file_path (str): one Newick tree per line
+    - leaf2idx (dict str -> int)
+    - num_landmarks, dimensions, seed, processes, batch_size: see
+      LandmarkMDS and LandmarkMDS.transform_stream
+    Output:
+    - generator of (numpy.ndarray): coordinates of every tree of the file
+    """
+    sample = reservoir_sample(read_trees(file_path), num_landmarks, seed=seed)
+    landmarks = [
+        TreeVec(tree=Tree(newick_str, format=1), leaf2idx=leaf2idx)
+        for newick_str in sample
+    ]
+    mds = LandmarkMDS(landmarks, dimensions=dimensions, processes=processes)
+    trees = (
+        TreeVec(tree=Tree(newick_str, format=1), leaf2idx=leaf2idx)
+        for newick_str in read_trees(file_path)
+    )
+    return mds.transform_stream(trees, batch_size=batch_size)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Landmark MDS embedding of a tree collection under the hop distance"
+    )
+    parser.add_argument("file", type=str, help="File with one Newick tree per line")
+    parser.add_argument("leaf2idx", type=str, help="JSON file: leaf name -> index (1-base)")
+    parser.add_argument("--landmarks", type=int, default=50)
+    parser.add_argument("--dimensions", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    with open(args.leaf2idx, 'r', encoding='utf-8') as file:
+        leaf2idx = json.load(file)
+    for coordinates in embed_file(
+            args.file, leaf2idx, num_landmarks=args.landmarks,
+            dimensions=args.dimensions, seed=args.seed,
+            processes=args.processes, batch_size=args.batch_size
+    ):
+        print("\t".join(f"{x:.6g}" for x in coordinates))
@@ -0,0 +1,177 @@
+from ete3 import Tree
+from nonbinary import TreeVec
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import re
+
+# Comments of NEXUS files, including BEAST annotations [&...]
+COMMENT = re.compile(r"\[[^\]]*\]")
+# Translate item: TOKEN NAME, the name may be quoted and contain spaces and
+# commas ('' is a quote in a single-quoted name)
+TRANSLATE_ITEM = re.compile(r"""([^\s,;]+)\s+('(?:[^']|'')*'|"[^"]*"|[^\s,;]+)""")
+# Tree line: tree NAME = NEWICK;
+TREE_LINE = re.compile(rb"^\s*tree\s+", re.IGNORECASE)
+
+def read_translate(file_path):
+    """
+    Read the translate block of the trees block of a NEXUS file
+    Input:
+    - file_path (str)
+    Output:
+    - (dict str -> str): token used in the trees -> leaf name, empty if there is
+      no translate block; tokens are in file order
+    """
+    translate, in_translate = {}, False
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = COMMENT.sub("", line).strip()
+            if not in_translate:
+                if line.lower().startswith("translate"):
+                    in_translate, line = True, line[len("translate"):]
+                elif TREE_LINE.match(line.encode()):
+                    break
+            if in_translate:
+                for token, name in TRANSLATE_ITEM.findall(line):
+                    if name[0] == "'":
+                        name = name[1:-1].replace("''", "'")
+                    elif name[0] == '"':
+                        name = name[1:-1]
+                    translate[token] = name
+                if line.endswith(";"):
+                    break
+    return translate
+
+def tree_offsets(file_path):
+    """
+    Byte ranges of the tree lines of a NEXUS file, without parsing them; a
+    tree is expected on a single line, as written by BEAST and MrBayes
+    Output:
+    - list((int,int)): (offset, length) of every tree line, in file order
+    """
+    offsets = []
+    with open(file_path, 'rb') as file:
+        offset = 0
+        for line in file:
+            if TREE_LINE.match(line):
+                offsets.append((offset, len(line)))
+            offset += len(line)
+    return offsets
+
+def parse_tree_line(line, translate):
+    """
+    Parse a tree line: tree NAME = [&R] NEWICK;
+    Input:
+    - line (str)
+    - translate (dict str -> str): token -> leaf name, may be empty
+    Output:
+    - (Tree): leaves named by their leaf name
+    """
+    newick_str = COMMENT.sub("", line).split("=", 1)[1].strip()
+    tree = Tree(newick_str, format=1)
+    if translate:
+        for leaf in tree.iter_leaves():
+            leaf.name = translate[leaf.name]
+    return tree
+
+def _convert_chunk(file_path, offsets, translate, leaf2idx):
+    """
+    Convert the trees of a chunk of byte ranges of a file
+    Output:
+    - list(TreeVec)
+    """
+    result = []
+    with open(file_path, 'rb') as file:
+        for offset, length in offsets:
+            file.seek(offset)
+            line = file.read(length).decode('utf-8')
+            result.append(TreeVec(tree=parse_tree_line(line, translate), leaf2idx=leaf2idx))
+    return result
+
+def select_offsets(offsets, burnin=0, thin=1):
+    """
+    Apply a burn-in and a thinning to the tree lines of a file
+    Input:
+    - offsets (list((int,int))): see tree_offsets
+    - burnin (int or float): number of trees, or fraction of the trees if a
+      float, skipped at the start of the file
+    - thin (int): keep one tree every thin trees after the burn-in
+    Output:
+    - list((int,int))
+    """
+    if isinstance(burnin, float):
+        burnin = int(burnin * len(offsets))
+    return offsets[burnin::thin]
+
+def _convert_names(file_path, offset):
+    """
+    Leaf names of the tree line at a byte range, without translation
+    """
+    with open(file_path, 'rb') as file:
+        file.seek(offset[0])
+        line = file.read(offset[1]).decode('utf-8')
+    return parse_tree_line(line, {}).get_leaf_names()
+
+def load_nexus(file_path, leaf2idx=None, burnin=0, thin=1, processes=None, chunksize=None):
+    """
+    Load the trees of a NEXUS file (BEAST, MrBayes) in parallel: tree lines are
+    located by a byte-level pass, the burn-in and thinning are applied, and
+    chunks of byte ranges are converted by worker processes, so skipped trees
+    are never parsed
+    Input:
+    - file_path (str)
+    - leaf2idx (dict str -> int): leaf order; if None, the leaves in the order
+      of the translate block, or sorted by name if there is none
+    - burnin (int or float), thin (int): see select_offsets
+    - processes (int): number of worker processes, if None os.cpu_count(); if
+      1, converted in the current process
+    - chunksize (int): number of trees per task, if None about 4 tasks per
+      worker
+    Output:
+    - (dict str -> int, list(TreeVec)): leaf2idx and the trees in file order
+    """
+    translate = read_translate(file_path)
+    offsets = select_offsets(tree_offsets(file_path), burnin=burnin, thin=thin)
+    if leaf2idx is None:
+        if translate:
+            names = list(translate.values())
+        elif offsets:
+            names = sorted(_convert_names(file_path, offsets[0]))
+        else:
+            names = []
+        leaf2idx = {names[i]: i+1 for i in range(0,len(names))}
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1 or len(offsets) <= 1:
+        return leaf2idx, _convert_chunk(file_path, offsets, translate, leaf2idx)
+    if chunksize is None:
+        chunksize = max(1, len(offsets) // (4*processes))
+    chunks = [offsets[i:i+chunksize] for i in range(0,len(offsets),chunksize)]
+    trees = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for chunk_trees in executor.map(
+                _convert_chunk, [file_path] * len(chunks), chunks,
+                [translate] * len(chunks), [leaf2idx] * len(chunks)
+        ):
+            trees += chunk_trees
+    return leaf2idx, trees
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert the trees of a NEXUS file and write them in Newick format"
+    )
+    parser.add_argument("file", type=str, help="NEXUS file (BEAST, MrBayes)")
+    parser.add_argument(
+        "--burnin", type=float, default=0,
+        help="Trees skipped at the start: a number, or a fraction if below 1"
+    )
+    parser.add_argument("--thin", type=int, default=1)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    burnin = args.burnin if args.burnin < 1 else int(args.burnin)
+    leaf2idx, trees = load_nexus(
+        args.file, burnin=burnin, thin=args.thin, processes=args.processes
+    )
+    for treevec in trees:
+        print(treevec.treevec2newick())
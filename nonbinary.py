@@ -1,12 +1,73 @@
 from ete3 import Tree
 from LIS import LIS_len, LIS_seq
-from random import randint
+from LCS1 import multi_lcs
+from random import randint, Random
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from array import array
+import profiling
 
 # Separator between a label and a node name in a tree representation
 SEP_NODE = ":"
 # Separators between tree representation elements
 SEP_VEC = ","
 
+# Minimum number of vector entries per worker for hop_similarity to run in
+# parallel. Without an executor, every parallel call starts its own process
+# pool: about 10 ms with fork, 0.5 s with spawn (macOS, Windows), where every
+# worker imports the modules again; pass an executor to reuse one pool
+PARALLEL_MIN_ENTRIES = 1 << 15
+
+def _relabel_segment(segment1, segment2, prof=None):
+    """
+    Relabel the labels of segment1 increasingly from 0 
+    and the labels of segment2 according to the relabeling of 
+    segment1, excluding labels not present in segment1
+    The segments are not modified, so this can run concurrently on shared
+    vectors.
+    Output:
+    - (list,list(int)): segment1 with set labels converted to frozensets,
+      relabeled segment2
+    """
+    if prof is not None:
+        start = perf_counter()
+    segment1 = [frozenset(x) if isinstance(x, set) else x for x in segment1]
+    segment2 = [frozenset(x) if isinstance(x, set) else x for x in segment2]
+    if prof is not None:
+        start = prof.add_time("hop_similarity.frozenset", start)
+    # map1[x] = position of label x in segment1
+    map1 = {segment1[i1]: i1 for i1 in range(0,len(segment1))}
+    # Relabeling segment2 according to __map1,
+    # excluding labels not in segment1
+    relabeled_segment2 = []
+    for i2 in range(0,len(segment2)):
+        if segment2[i2] in map1.keys():
+            relabeled_segment2.append(map1[segment2[i2]])
+    if prof is not None:
+        prof.add_time("hop_similarity.relabel", start)
+    return segment1, relabeled_segment2
+
+def _segments_lcs(segment_pairs, compute_seq):
+    """
+    LCS of pairs of segments, task of a worker of a parallel hop_similarity
+    Input:
+    - segment_pairs (list((list,list))): pairs of non-empty segments of labels
+    - compute_seq (bool)
+    Output:
+    - compute_seq=False: (int) sum of the LCS lengths
+    - compute_seq=True: list(list): an LCS of every pair, as labels of the first
+      segment
+    """
+    lcs_len,lcs_seq = 0,[]
+    for segment1,segment2 in segment_pairs:
+        segment1, relabeled_segment2 = _relabel_segment(segment1, segment2)
+        if compute_seq:
+            lcs_seq.append([segment1[i2] for i2 in LIS_seq(relabeled_segment2)])
+        else:
+            lcs_len += LIS_len(relabeled_segment2)
+    return (lcs_seq if compute_seq else lcs_len)
+
 # Main Class
 class TreeVec:
     """
@@ -59,7 +120,9 @@ class TreeVec:
             leaf2idx=None,
             idx2leaf=None,
             format=None,
-            compact=None
+            compact=None,
+            names=True,
+            validate=False
     ):
         """
         Instantiate a vector representation for a tree on n leaves
@@ -76,13 +139,18 @@ class TreeVec:
         - idx2leaf (dict int -> str): reverse dictionary
         - format (int in [1,2])
         - compact (bool)
+        - names (bool): if False, internal nodes of a converted tree have the
+          name None, computed from their label only when simvec is accessed
+        - validate (bool): if True, treevec_vec is checked (see validate)
         """
         self.vector = []
-        self.simvec = []
+        self._simvec = None
         if treevec_vec is not None:
             self.vector = treevec_vec
+            if validate:
+                self.validate()
         elif tree is not None:            
-            self.vector = self.tree2treevec(tree, leaf2idx=leaf2idx)
+            self.vector = self.tree2treevec(tree, leaf2idx=leaf2idx, names=names)
         # elif newick_str is not None:
             # self.vector = self.newick2treevec(newick_str, leaf2idx=leaf2idx)
         # elif treevec_str is not None:
@@ -90,8 +158,76 @@ class TreeVec:
                 # treevec_str, idx2leaf,
                 # format=format, compact=compact
             # )    
-        self.simvec = [sublist[1] for sublist in self.vector]
+
+    @property
+    def simvec(self):
+        """
+        Names of the vector entries, computed on first access; an internal node
+        with the name None is named by the set of the names of the leaves of its
+        label
+        """
+        if self._simvec is None:
+            v = self.vector
+            idx2leaf = {x[0]: x[1] for x in v if x[3]}
+            self._simvec = [
+                {idx2leaf[i] for i in x[0]} if x[1] is None and not x[3] else x[1]
+                for x in v
+            ]
+        return self._simvec
+
+    @simvec.setter
+    def simvec(self, simvec):
+        self._simvec = simvec
     
+    def validate(self):
+        """
+        Check the encoding invariants of the vector in a single pass, in time
+        linear in the size of the vector, without decoding it:
+        - the first entry is the root, an internal node labeled {1}
+        - the leaves are labeled 1 to n in vector order and the last entry is
+          leaf n
+        - an internal node before leaf j has a non-empty set label of integers
+          in (j,n]
+        - every integer of 2 to n is in exactly one internal node label
+        Raises ValueError on the first violated invariant, including entries
+        that are not lists [label, name, dist, is_leaf] with a bool is_leaf.
+        """
+        v = self.vector
+        if not isinstance(v, list):
+            raise ValueError("the vector must be a list")
+        for p in range(0,len(v)):
+            if not isinstance(v[p], (list, tuple)) or len(v[p]) != 4:
+                raise ValueError(f"entry {p}: expected [label, name, dist, is_leaf]")
+            if not isinstance(v[p][3], bool):
+                raise ValueError(f"entry {p}: is_leaf must be a bool")
+        if not v or v[0][3] or v[0][0] != {1}:
+            raise ValueError("entry 0: the root must be an internal node labeled {1}")
+        if not v[-1][3]:
+            raise ValueError(f"entry {len(v)-1}: the last entry must be a leaf")
+        n = sum(1 for x in v if x[3])
+        seen = [False] * (n+1)
+        seen[1] = True
+        # j = label of the leaf ending the current segment
+        j = 1
+        for p in range(1,len(v)):
+            label = v[p][0]
+            if v[p][3]:
+                if label != j:
+                    raise ValueError(f"entry {p}: leaf {label}, expected leaf {j}")
+                j += 1
+                continue
+            if not isinstance(label, (set, frozenset)) or not label:
+                raise ValueError(f"entry {p}: internal node label must be a non-empty set")
+            for i in label:
+                if not isinstance(i, int) or not j < i <= n:
+                    raise ValueError(f"entry {p}: label {i} not in ({j},{n}]")
+                if seen[i]:
+                    raise ValueError(f"entry {p}: label {i} appears twice")
+                seen[i] = True
+        for i in range(2,n+1):
+            if not seen[i]:
+                raise ValueError(f"label {i} is in no internal node")
+
     def find(self, label: dict, k: int):
         # 从键为1开始遍历字典
         for key in range(1, len(label)):
@@ -109,101 +245,490 @@ class TreeVec:
         Ouput:
         - (Tree) Tree object
         """
+        prof = profiling.PROFILER
+        if prof is not None:
+            start = perf_counter()
         v = self.vector
-        # n = int(((a-1)*len(v)+2-a) / a)
-        # Computing the label and name of each node
-        __label, __name, __dist, edges = {}, {}, {}, {}
-        for i in range(0,len(v)):
-            [label,name,dist,leaf] = v[i]
-            __label[i] = label
-            edges[label] = []
-            __name[label] = name
-            __dist[label] = dist
-        # Decoding into edges
-        # edges = {i: [] for i in range(1,len(v)+1)}
-        o = {j: (2 if v[j][3] else 1) for j in range(0,len(v))}
-        for j in range(0,len(v)-1):
-            if o[j] == 1 and o[j+1] == 1:
-                edges[__label[j]].append(__label[j+1])
-            elif o[j] == 1 and o[j+1] == 2:
-                edges[__label[j]].append(__label[j+1])
-            elif o[j] == 2 and o[j+1] == 1:
-                k = j+2
-                while o[k] == 1: k += 1
-                edges[__label[self.find(__label, __label[k])]].append(__label[j+1])
-            elif o[j] == 2 and o[j+1] == 2:
-                edges[__label[self.find(__label, __label[j+1])]].append(__label[j+1])
+        # Decoding into edges between positions in v
+        children = self.treevec2children()
+        if prof is not None:
+            start = prof.add_time("treevec2tree.decoding", start)
         # Creating Tree structure
-        # nodes = {i: Tree(name=__name[i],dist=__dist[i]) for i in range(1,2*n+1)}
-        nodes = {}
-        for i in range(0,len(v)):
-            nodes[__label[i]] = Tree(name=__name[i],dist=__dist[i])
-        for node_from_idx,nodes_to_idx in edges.items():
-            node_from = nodes[node_from_idx]
-            for node_to_idx in nodes_to_idx:
-                node_from.add_child(nodes[node_to_idx])
-        root = nodes[__label[0]].children[0]
+        names = self.simvec
+        nodes = [Tree(name=names[p],dist=v[p][2]) for p in range(0,len(v))]
+        for p in range(0,len(v)):
+            for c in children[p]:
+                nodes[p].add_child(nodes[c])
+        root = nodes[0].children[0]
+        root.detach()
+        if prof is not None:
+            prof.add_time("treevec2tree.nodes", start)
+            prof.count("treevec2tree.calls")
         return root
     
-    def tree2treevec(self, tree, leaf2idx=None):
+    def treevec2newick(self, dist_format="%0.6g"):
+        """
+        Given a tree vector representation, compute its Newick string (format=1)
+        without creating Tree objects
+        Input:
+        - dist_format (str): format of branch lengths
+        Output:
+        - (str) Newick string; internal node names are written only if they are
+          strings (names built from labels are sets)
+        """
+        v = self.vector
+        children = self.treevec2children()
+        root = children[0][0]
+
+        def __name(p):
+            name = v[p][1]
+            return name if isinstance(name, str) else ""
+
+        out = []
+        # stack of positions to write or of already written closing tokens
+        stack = [root]
+        while stack:
+            p = stack.pop()
+            if isinstance(p, str):
+                out.append(p)
+                continue
+            suffix = "" if p == root else ":" + dist_format % v[p][2]
+            if v[p][3]:
+                out.append(__name(p) + suffix)
+                continue
+            out.append("(")
+            stack.append(")" + __name(p) + suffix)
+            for i in range(len(children[p])-1, -1, -1):
+                stack.append(children[p][i])
+                if i > 0:
+                    stack.append(",")
+        return "".join(out) + ";"
+
+    @staticmethod
+    def write_newick(treevecs, file, dist_format="%0.6g"):
+        """
+        Write a collection of tree representations in Newick format, one tree per
+        line, as they are read from treevecs
+        Input:
+        - treevecs (iterable(TreeVec))
+        - file: text file handle
+        - dist_format (str): format of branch lengths
+        """
+        for treevec in treevecs:
+            file.write(treevec.treevec2newick(dist_format=dist_format))
+            file.write("\n")
+
+    def tree2treevec(self, tree, leaf2idx=None, names=True):
         """
         Compute the vector representation of a tree with n leaves rom a Tree objet
         Input:
-        - t: Tree object with features "name" and "dist" (branch length)
+        - t: Tree object with features "name" and "dist" (branch length), not
+          modified
         - leaf2idx: dict(str -> int) leaf name to leaf label
         if None: leaf labels added during a postorder traversal in order of visit.
+        - names (bool): if False, internal nodes are named None instead of the set
+          of the names of the leaves of their label (see simvec)
         """
-        # Adding a root labeled 1 and named ""
-        T = Tree(name="")
-        if leaf2idx is not None:
-            for key, value in leaf2idx.items():
-                    if value == 1:
-                        T.name = {key}
-        T.add_feature("label", {1})
-        T.add_child(tree)
+        prof = profiling.PROFILER
+        if prof is not None:
+            start = perf_counter()
         # Labeling nodes
+        min_label, node_label, label2leaf = {}, {}, {}
         label = 1
         for node in tree.traverse("postorder"):
-            if node.is_leaf() and leaf2idx is not None:
-                node.add_feature("label", leaf2idx[node.name])
-                node.add_feature("min_label", node.label)
-            elif node.is_leaf():
-                node.add_feature("label", label)
-                node.add_feature("min_label", node.label)
-                label += 1
-            else:
-                children_min_label = [child.min_label for child in node.children]
-                node.add_feature("min_label", min(children_min_label))
-                # node.add_feature("label", max(children_min_label))
-                node.add_feature("label", set(children_min_label).difference({node.min_label}))
-                new_set = set()
-                for key, value in leaf2idx.items():
-                    if value in node.label:
-                        new_set.add(key)
-                node.name = new_set
-        # Computing a dictionary from label to leaf
-        label2leaf = {}
-        for node in T.traverse("postorder"):
             if node.is_leaf():
-                label2leaf[node.label] = node
-                n = len(label2leaf.keys())
-                # Computing paths from leaves to the internal node of same label
-        paths = {}
+                if leaf2idx is not None:
+                    min_label[node] = leaf2idx[node.name]
+                else:
+                    min_label[node] = label
+                    label += 1
+                label2leaf[min_label[node]] = node
+            else:
+                children_min_label = [min_label[child] for child in node.children]
+                min_label[node] = min(children_min_label)
+                node_label[node] = set(children_min_label).difference({min_label[node]})
+        if prof is not None:
+            start = prof.add_time("tree2treevec.labeling", start)
+        n = len(label2leaf)
+        idx2leaf = {i: label2leaf[i].name for i in range(1,n+1)}
+
+        def __name(label):
+            return {idx2leaf[i] for i in label} if names else None
+
+        # Concatenating reversed paths from leaves to the internal node of same
+        # label; the path of leaf 1 ends at the added root labeled {1}
+        v = [[{1}, __name({1}), 0.0, False]]
         for i in range(1,n+1):
-            paths[i] = []
-            node = label2leaf[i].up
-            # while node.label != i:
-            while i not in node.label:
-                paths[i].append([node.label, node.name, node.dist, False])
+            path = []
+            leaf = label2leaf[i]
+            node = leaf.up
+            while node is not tree.up and i not in node_label[node]:
+                path.append([node_label[node], __name(node_label[node]), node.dist, False])
                 node = node.up
-        # Concatenating reversed paths
-        v = [[{1}, T.name, 0.0, False]]
+            v += path[::-1] + [[i,leaf.name,leaf.dist,True]]
+        if prof is not None:
+            prof.add_time("tree2treevec.paths", start)
+            prof.count("tree2treevec.calls")
+            prof.count("tree2treevec.nodes", len(v))
+        return v
+
+    def treevec2children(self):
+        """
+        Compute the tree structure encoded by the vector without creating Tree
+        objects; nodes are identified by their position in the vector
+        Output:
+        - list(list(int)): children[p] = positions of the children of the node at
+          position p, ordered by increasing smallest leaf label; the root
+          (position 0) has a single child
+        Every node appears at a larger position than its parent.
+        """
+        v = self.vector
+        children = [[] for _ in range(0,len(v))]
+        # holder[i] = position of the internal node whose label contains i
+        holder = {}
+        for p in range(0,len(v)):
+            if not v[p][3]:
+                for i in v[p][0]:
+                    holder[i] = p
+        # segment = index of the leaf ending the current segment,
+        # previous = position of the previous node of the segment
+        segment, previous = 1, None
+        for p in range(0,len(v)):
+            if previous is not None:
+                children[previous].append(p)
+            elif p > 0:
+                children[holder[segment]].append(p)
+            if v[p][3]:
+                segment, previous = segment+1, None
+            else:
+                previous = p
+        return children
+
+    @staticmethod
+    def children2treevec(root, children, order, leaf_label, name, dist):
+        """
+        Compute the vector representation of a tree given by its structure
+        Input:
+        - root: identifier of the root of the tree
+        - children (dict or list): children[x] = list of the children of node x
+        - order (iterable): identifiers of all nodes, every node after its parent
+        - leaf_label (dict): leaf identifier -> leaf label, labels from 1 to n
+        - name (dict): leaf identifier -> leaf name
+        - dist (dict): node identifier -> length of the branch to the parent
+        Output:
+        - list([int,str,float,bool]): vector, internal nodes named by the set of
+          the names of the leaves of their label
+        """
+        order = list(order)
+        parent = {root: None}
+        for x in order:
+            for y in children[x]:
+                parent[y] = x
+        # Labeling nodes in postorder
+        min_label, node_label = {}, {}
+        for x in reversed(order):
+            if x in leaf_label:
+                min_label[x] = leaf_label[x]
+            else:
+                children_min_label = [min_label[y] for y in children[x]]
+                min_label[x] = min(children_min_label)
+                node_label[x] = set(children_min_label).difference({min_label[x]})
+        label2leaf = {label: x for x,label in leaf_label.items()}
+        idx2leaf = {label: name[x] for x,label in leaf_label.items()}
+        n = len(label2leaf)
+        # Concatenating reversed paths from leaves to the internal node of same label
+        v = [[{1}, {idx2leaf[1]}, 0.0, False]]
         for i in range(1,n+1):
+            path = []
             leaf = label2leaf[i]
-            v += paths[i][::-1] + [[i,leaf.name,leaf.dist,True]]
+            x = parent[leaf]
+            while x is not None and i not in node_label[x]:
+                path.append(
+                    [node_label[x], {idx2leaf[j] for j in node_label[x]}, dist[x], False]
+                )
+                x = parent[x]
+            v += path[::-1] + [[i,name[leaf],dist[leaf],True]]
         return v
+
+    def __renumber(self, old2new):
+        """
+        Compute the vector of the tree restricted to a subset of its leaves,
+        with new leaf labels; nodes left with a single child are removed and
+        their branch length is added to the one of their child
+        Input:
+        - old2new (dict int -> int): current leaf label -> new leaf label, for
+          the kept leaves; new labels are 1 to the number of kept leaves
+        Output:
+        - (TreeVec)
+        """
+        v = self.vector
+        children = self.treevec2children()
+        # rep[p] = node representing the subtree of position p in the restricted
+        # tree, None if it contains no kept leaf
+        rep = [None] * len(v)
+        new_children, new_dist, leaf_label, name = {}, {}, {}, {}
+        for p in range(len(v)-1, 0, -1):
+            if v[p][3]:
+                if v[p][0] in old2new:
+                    rep[p] = p
+                    new_dist[p] = v[p][2]
+                    leaf_label[p] = old2new[v[p][0]]
+                    name[p] = v[p][1]
+                continue
+            kept = [rep[c] for c in children[p] if rep[c] is not None]
+            if len(kept) == 1:
+                rep[p] = kept[0]
+                new_dist[kept[0]] += v[p][2]
+            elif len(kept) > 1:
+                rep[p] = p
+                new_children[p] = kept
+                new_dist[p] = v[p][2]
+        root = rep[children[0][0]]
+        order = [p for p in range(1,len(v)) if rep[p] == p]
+        for p in leaf_label:
+            new_children[p] = []
+        return TreeVec(treevec_vec=self.children2treevec(
+            root, new_children, order, leaf_label, name, new_dist
+        ))
+
+    @staticmethod
+    def random(n, polytomy_rate=0.0, rng=None, idx2leaf=None):
+        """
+        Sample a tree vector representation directly, in time O(n)
+        Input:
+        - n (int): number of leaves, n >= 1
+        - polytomy_rate (float): probability to contract each internal edge of
+          the binary tree; 0.0 gives a uniform random rooted binary tree
+        - rng (random.Random): if None, a generator seeded from the module
+          random generator is used
+        - idx2leaf (dict int -> str): leaf names, if None leaf i is named str(i)
+        Output:
+        - (TreeVec): branch lengths are 1.0 (0.0 for the root)
+        """
+        if rng is None:
+            rng = Random(randint(0, 2**32))
+        if idx2leaf is None:
+            idx2leaf = {i: str(i) for i in range(1,n+1)}
+        # Nodes: leaf i is i and the internal node of label {i} is n+i,
+        # kept in a linked list in vector order, the root being n+1
+        nxt = [None] * (2*n+1)
+        prv = [None] * (2*n+1)
+        nxt[n+1], prv[1] = 1, n+1
+        # Binary tree: the first occurrence of i is inserted before an existing
+        # node other than the root chosen uniformly, i.e. before the second
+        # occurrence of i-1; there are 2i-3 choices
+        for i in range(2,n+1):
+            r = rng.randrange(2*i-3)
+            x = r+1 if r < i-1 else n+r-i+3
+            y = n+i
+            nxt[prv[x]], prv[y], nxt[y], prv[x] = y, prv[x], x, y
+            nxt[i-1], prv[i] = i, i-1
+        order = []
+        x = n+1
+        while x is not None:
+            order.append(x)
+            x = nxt[x]
+        # Contracting internal edges, nodes being visited after their parent;
+        # rep[x] = node of the nonbinary tree x is merged into
+        label = {x: {x-n} for x in range(n+1,2*n+1)}
+        rep = {}
+        # previous = previous internal node of the segment, None at its start
+        previous, segment = None, 1
+        for x in order:
+            if x <= n:
+                previous, segment = None, segment+1
+                continue
+            # parent in the binary tree: previous node of the segment or, for
+            # the first node of the segment, the node of label {segment}
+            parent = previous if previous is not None else n+segment
+            if (
+                    x != n+1 and parent != n+1 and polytomy_rate > 0.0
+                    and rng.random() < polytomy_rate
+            ):
+                rep[x] = rep[parent]
+                label[rep[x]] |= label.pop(x)
+            else:
+                rep[x] = x
+            previous = x
+        v = []
+        for x in order:
+            dist = 0.0 if x == n+1 or x == order[1] else 1.0
+            if x <= n:
+                v.append([x, idx2leaf[x], dist, True])
+            elif rep[x] == x:
+                v.append([label[x], {idx2leaf[j] for j in label[x]}, dist, False])
+        return TreeVec(treevec_vec=v)
+
+    @staticmethod
+    def random_collection(count, n, polytomy_rate=0.0, seed=None, idx2leaf=None):
+        """
+        Sample tree vector representations directly (see TreeVec.random)
+        Input:
+        - count (int): number of trees
+        - n (int): number of leaves
+        - polytomy_rate (float)
+        - seed: seed of the random generator, the collection is reproducible if
+          not None
+        - idx2leaf (dict int -> str)
+        Output:
+        - generator of (TreeVec)
+        """
+        rng = Random(seed)
+        for _ in range(0,count):
+            yield TreeVec.random(n, polytomy_rate=polytomy_rate, rng=rng, idx2leaf=idx2leaf)
+
+    def leaf_labels(self):
+        """
+        Output:
+        - (dict str -> int): leaf name -> leaf label
+        """
+        return {x[1]: x[0] for x in self.vector if x[3]}
+
+    def restrict(self, leaves):
+        """
+        Compute the vector of the tree restricted to a subset of its leaves,
+        directly on the vector, in time linear in the size of the vector
+        Input:
+        - leaves (iterable(str)): names of the leaves to keep
+        Output:
+        - (TreeVec): kept leaves are relabeled from 1 in their current order;
+          nodes left with a single child are removed and their branch length is
+          added to the one of their child
+        """
+        leaf2idx = self.leaf_labels()
+        kept = sorted(leaf2idx[leaf] for leaf in set(leaves))
+        return self.__renumber({kept[i]: i+1 for i in range(0,len(kept))})
+
+    def relabel(self, leaf2idx):
+        """
+        Compute the vector of the same tree under another leaf order, directly
+        on the vector, in time linear in the size of the vector
+        Input:
+        - leaf2idx (dict str -> int): new leaf order, containing all the leaves
+        Output:
+        - (TreeVec): self if the leaf order is unchanged
+        """
+        old2new = {idx: leaf2idx[leaf] for leaf,idx in self.leaf_labels().items()}
+        if all(old == new for old,new in old2new.items()):
+            return self
+        return self.__renumber(old2new)
+
+    @staticmethod
+    def relabel_collection(treevecs, leaf2idx):
+        """
+        Relabel a collection of tree representations under a new leaf order
+        Input:
+        - treevecs (iterable(TreeVec)): trees on the leaves of leaf2idx, possibly
+          with different leaf orders
+        - leaf2idx (dict str -> int): new leaf order
+        Output:
+        - list(TreeVec)
+        The label mapping is computed once per distinct leaf order of the
+        collection and trees already in the new order are not copied.
+        """
+        result = []
+        # old2new[leaf names in label order] = label mapping for this leaf order
+        old2new = {}
+        for treevec in treevecs:
+            order = tuple(x[1] for x in treevec.vector if x[3])
+            if order not in old2new:
+                mapping = {i+1: leaf2idx[order[i]] for i in range(0,len(order))}
+                if all(old == new for old,new in mapping.items()):
+                    mapping = None
+                old2new[order] = mapping
+            if old2new[order] is None:
+                result.append(treevec)
+            else:
+                result.append(treevec.__renumber(old2new[order]))
+        return result
+
+    def restrict_common(self, t2):
+        """
+        Restrict two tree representations to their common leaves
+        Input:
+        - t2 (TreeVec)
+        Output:
+        - (TreeVec,TreeVec): both trees restricted to the leaves with a name
+          present in both trees, with leaf labels following the leaf order of self
+        """
+        leaf2idx1, leaf2idx2 = self.leaf_labels(), t2.leaf_labels()
+        common = sorted(
+            (leaf2idx1[leaf] for leaf in leaf2idx1.keys() & leaf2idx2.keys())
+        )
+        old2new1 = {common[i]: i+1 for i in range(0,len(common))}
+        idx2leaf1 = {idx: leaf for leaf,idx in leaf2idx1.items()}
+        old2new2 = {leaf2idx2[idx2leaf1[i]]: old2new1[i] for i in common}
+        return self.__renumber(old2new1), t2.__renumber(old2new2)
+
+    def __parallel_lcs(self, t2, boundaries, second_occ_order, compute_seq, processes,
+                       executor=None):
+        """
+        Parallel part of hop_similarity: pairs of non-empty segments are split
+        into about 4 chunks per worker of similar total size, and the partial
+        LCS are merged in segment order; run by executor, or by a process pool
+        started for the call if None
+        """
+        v1,v2 = self.vector,t2.vector
+        segments, total = {}, 0
+        for j in range(0,len(boundaries[1])):
+            b1_start,b1_end = boundaries[1][j]
+            b2_start,b2_end = boundaries[2][j]
+            if (b1_end>=b1_start) and (b2_end>=b2_start):
+                segments[j] = (
+                    [v1[k][0] for k in range(b1_start, b1_end+1)],
+                    [v2[k][0] for k in range(b2_start, b2_end+1)]
+                )
+                total += len(segments[j][0]) + len(segments[j][1])
+        # Chunks of consecutive segments
+        chunk_size = max(1, total // (4*processes))
+        chunks, chunk, size = [], [], 0
+        for j,(segment1,segment2) in segments.items():
+            chunk.append(j)
+            size += len(segment1) + len(segment2)
+            if size >= chunk_size:
+                chunks.append(chunk)
+                chunk, size = [], 0
+        if chunk:
+            chunks.append(chunk)
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                return self.__parallel_lcs(
+                    t2, boundaries, second_occ_order, compute_seq, processes,
+                    executor=executor
+                )
+        results = executor.map(
+            _segments_lcs,
+            [[segments[j] for j in chunk] for chunk in chunks],
+            repeat(compute_seq)
+        )
+        if not compute_seq:
+            return sum(results)
+        lcs = {}
+        for chunk,chunk_lcs in zip(chunks, results):
+            lcs.update(zip(chunk, chunk_lcs))
+        lcs_seq = []
+        for j in range(0,len(second_occ_order)):
+            if j in lcs:
+                lcs_seq += [(x,False) for x in lcs[j]]
+            lcs_seq += [(second_occ_order[j],True)]
+        return lcs_seq
+
+    def hop_distance(self, t2):
+        """
+        Compute the hop distance to another tree representation
+        Input:
+        - t2 (TreeVec)
+        assumption: both are on the same leaves order
+        Output:
+        - (int): number of internal nodes of the tree with the most internal
+          nodes that are not in an LCS between both vectors
+        """
+        m1 = sum(1 for x in self.vector if not x[3])
+        m2 = sum(1 for x in t2.vector if not x[3])
+        return max(m1,m2) - self.hop_similarity(t2)
     
-    def hop_similarity(self, t2, compute_seq=False):
+    def hop_similarity(self, t2, compute_seq=False, common_leaves=False, processes=None,
+                       executor=None):
         """
         Compute the hop smilarity to another tree representations
         Input:
@@ -211,34 +736,22 @@ class TreeVec:
         assumption: both are on the same leaves order (asserted)
         - compute_seq (bool): if True, returns an actual LCS, if False, returns
           the similarity value
+        - common_leaves (bool): if True, both trees are first restricted to
+          their common leaves (see restrict_common), so the assumption above is
+          not required
+        - processes (int): if larger than 1, the segments are compared in
+          parallel by at most this number of worker processes, in chunks of
+          segments with similar total size; small trees are compared serially
+        - executor (concurrent.futures.Executor): pool running the parallel
+          comparison, to reuse across calls (see PARALLEL_MIN_ENTRIES); if None,
+          a process pool is started for the call
         Output:
         - compute_seq=False: (int) in [0,n]
         - compute_seq=True: list((int,bool)) list of (integers,True if leaf)
-          encoding the LCS between v1 and v2
+          encoding the LCS between v1 and v2; see iter_lcs and compact_lcs for
+          a streaming form
         """
         
-        def __relabel_segment(segment1, segment2):
-            """
-            Relabel the labels of segment1 increasingly from 0 
-            and the labels of segment2 according to the relabeling of 
-            segment1, excluding labels not present in segment1
-            """
-            for j in range(0,len(segment1)):
-                if isinstance(segment1[j], set):
-                    segment1[j] = frozenset(segment1[j])
-            for j in range(0,len(segment2)):
-                if isinstance(segment2[j], set):
-                    segment2[j] = frozenset(segment2[j])
-            # map1[x] = position of label x in segment1
-            map1 = {segment1[i1]: i1 for i1 in range(0,len(segment1))}
-            # Relabeling segment2 according to __map1,
-            # excluding labels not in segment1
-            relabeled_segment2 = []
-            for i2 in range(0,len(segment2)):
-                if segment2[i2] in map1.keys():
-                    relabeled_segment2.append(map1[segment2[i2]])
-            return relabeled_segment2
-        
         def __Partition(segment1, segment2):
             result = []
             for A in segment1:
@@ -252,6 +765,15 @@ class TreeVec:
                     result.append(remaining_elements)  
             return result
     
+        if common_leaves:
+            t1,t2 = self.restrict_common(t2)
+            return t1.hop_similarity(
+                t2, compute_seq=compute_seq, processes=processes, executor=executor
+            )
+        prof = profiling.PROFILER
+        if prof is not None:
+            start = perf_counter()
+            prof.count("hop_similarity.calls")
         v1,v2 = self.vector,t2.vector
         n=0
         for i in range(0,len(v1)):
@@ -267,15 +789,19 @@ class TreeVec:
         # in v1 before leaf i+1 similar for boundaries2 and v2
         # if j>k: empty segment
         boundaries = {1: [], 2: []}
+        # v1 and v2 have different lengths if they have different numbers of
+        # internal nodes
         i1,i2 = 0,0
         for i in range(0,len(v1)):
-            leaf1,leaf2 = v1[i][3],v2[i][3]
-            if leaf1:
+            if v1[i][3]:
                 boundaries[1].append([i1,i-1])
                 i1 = i+1
-            if leaf2:
+        for i in range(0,len(v2)):
+            if v2[i][3]:
                 boundaries[2].append([i2,i-1])
                 i2 = i+1
+        if prof is not None:
+            prof.add_time("hop_similarity.boundaries", start)
         
         def nonbin_sim():
             lcs_len,lcs_seq = 0,[]
@@ -292,6 +818,14 @@ class TreeVec:
                     segment2 = __Partition(__segment1, __segment2)
                     
         
+        if processes is not None and processes > 1:
+            processes = min(processes, (len(v1)+len(v2)) // PARALLEL_MIN_ENTRIES)
+        if processes is not None and processes > 1:
+            return self.__parallel_lcs(
+                t2, boundaries, second_occ_order, compute_seq, processes,
+                executor=executor
+            )
+
         # Computes an LCS for each pair of segments using an LIS algorithm
         lcs_len,lcs_seq = 0,[]
         for j in range(0,n):
@@ -304,12 +838,202 @@ class TreeVec:
                 __segment2 = [v2[k][0] for k in range(b2_start, b2_end+1)] 
                 # Relabeling __segment2 according to __map1,
                 # excluding labels not in __segment1            
-                segment2 = __relabel_segment(__segment1, __segment2)
+                __segment1, segment2 = _relabel_segment(__segment1, __segment2, prof)
+                if prof is not None:
+                    start = perf_counter()
+                    prof.count("hop_similarity.segments")
+                    prof.record("hop_similarity.segment_size", len(__segment1))
                 # Computing an LIS in segment2
                 if compute_seq: lcs_seq += [
                         (__segment1[i2],False)
                         for i2 in LIS_seq(segment2)
                 ]
                 else: lcs_len += LIS_len(segment2)
+                if prof is not None:
+                    prof.add_time("hop_similarity.LIS", start)
+            elif prof is not None:
+                prof.count("hop_similarity.empty_segments")
             lcs_seq += [(second_occ_order[j],True)]
-        return (lcs_seq if compute_seq else lcs_len)
\ No newline at end of file
+        return (lcs_seq if compute_seq else lcs_len)
+
+    def iter_lcs(self, t2, positions=False):
+        """
+        Generate an LCS between both vectors segment by segment, in order,
+        without building the whole sequence: memory is bounded by the size of
+        the largest segments
+        Input:
+        - t2 (TreeVec): on the same leaves order
+        - positions (bool): if True, entries are given by their position in
+          self.vector instead of (label, is_leaf)
+        Output:
+        - generator of (label,bool) or (int): same sequence as
+          hop_similarity(t2, compute_seq=True)
+        """
+        v1,v2 = self.vector,t2.vector
+        i1,i2 = 0,0
+        while i1 < len(v1):
+            # Segments v1[i1:j1] and v2[i2:j2] end with the same leaf
+            j1,j2 = i1,i2
+            while not v1[j1][3]:
+                j1 += 1
+            while not v2[j2][3]:
+                j2 += 1
+            if j1 > i1 and j2 > i2:
+                segment1, segment2 = _relabel_segment(
+                    [v1[k][0] for k in range(i1,j1)],
+                    [v2[k][0] for k in range(i2,j2)]
+                )
+                for k in LIS_seq(segment2):
+                    yield i1+k if positions else (segment1[k],False)
+            yield j1 if positions else (v1[j1][0],True)
+            i1,i2 = j1+1,j2+1
+
+    def compact_lcs(self, t2):
+        """
+        LCS between both vectors in a compact encoding
+        Input:
+        - t2 (TreeVec): on the same leaves order
+        Output:
+        - (array('q'),bytearray): positions in self.vector of the LCS
+          entries, and a bit array where bit k (bit k%8 of byte k//8) is set if
+          entry k is a leaf
+        """
+        lcs_positions, leaf_bits = array('q'), bytearray()
+        for k,i in enumerate(self.iter_lcs(t2, positions=True)):
+            if k % 8 == 0:
+                leaf_bits.append(0)
+            if self.vector[i][3]:
+                leaf_bits[k >> 3] |= 1 << (k & 7)
+            lcs_positions.append(i)
+        return lcs_positions, leaf_bits
+
+    def __hop_limits(self):
+        """
+        Output:
+        - list(int): limit[p] = largest position an internal entry at position
+          p > 0 can be moved to, i.e. before the leaf min(label)-1; 0 for the
+          root and the leaves
+        """
+        v = self.vector
+        leaf_position = {}
+        for p in range(0,len(v)):
+            if v[p][3]:
+                leaf_position[v[p][0]] = p
+        return [
+            leaf_position[min(v[p][0])-1]-1 if p > 0 and not v[p][3] else 0
+            for p in range(0,len(v))
+        ]
+
+    def hop_move(self, p, q):
+        """
+        Compute the vector obtained by a hop: the internal entry at position p
+        is moved to position q
+        Input:
+        - p (int): position of an internal entry, p > 0
+        - q (int): 1 <= q <= the position of leaf min(label)-1, minus 1
+        Output:
+        - (TreeVec): entries are shared with self
+        """
+        v = self.vector[:p] + self.vector[p+1:]
+        v.insert(q, self.vector[p])
+        return TreeVec(treevec_vec=v)
+
+    def hop_neighbors(self):
+        """
+        Generate the trees at hop distance 1, each once, by sliding every
+        internal entry through its valid positions with adjacent swaps on a
+        single working vector, in O(1) amortized time per neighbour. Moving an
+        entry left by one over an internal entry gives the same vector as
+        moving that entry right by one, so only the latter is generated.
+        Output:
+        - generator of (int,int,list): (p, q, vector), the entry at position p
+          of self.vector is at position q of vector; vector is the working
+          list, modified after the next iteration: copy it to keep it
+        """
+        limit = self.__hop_limits()
+        w = list(self.vector)
+        for p in range(1,len(w)):
+            if w[p][3]:
+                continue
+            left_duplicate = not w[p-1][3] and p-1 > 0
+            for q in range(p-1,0,-1):
+                w[q],w[q+1] = w[q+1],w[q]
+                if q < p-1 or not left_duplicate:
+                    yield p, q, w
+            # Back to p, then right
+            for q in range(1,p):
+                w[q],w[q+1] = w[q+1],w[q]
+            for q in range(p+1,limit[p]+1):
+                w[q-1],w[q] = w[q],w[q-1]
+                yield p, q, w
+            for q in range(limit[p],p,-1):
+                w[q-1],w[q] = w[q],w[q-1]
+
+    def random_hop_moves(self, count, rng=None):
+        """
+        Sample hop moves to trees at hop distance 1 uniformly, with
+        replacement: a move (p,q) is drawn uniformly among all valid positions
+        of all internal entries and rejected if it is the identity or a
+        duplicate (see hop_neighbors)
+        Input:
+        - count (int): number of moves
+        - rng (random.Random)
+        Output:
+        - generator of (int,int): (p, q), apply with hop_move
+        """
+        if rng is None:
+            rng = Random(randint(0, 2**32))
+        v = self.vector
+        limit = self.__hop_limits()
+        positions = [p for p in range(1,len(v)) if not v[p][3]]
+        cum_weights, total = [], 0
+        for p in positions:
+            total += limit[p]
+            cum_weights.append(total)
+        if total <= len(positions):
+            # Every entry can only stay in place
+            return
+        k = 0
+        while k < count:
+            p = rng.choices(positions, cum_weights=cum_weights)[0]
+            q = rng.randint(1, limit[p])
+            if q == p or (q == p-1 and p-1 > 0 and not v[p-1][3]):
+                continue
+            k += 1
+            yield p, q
+
+    @staticmethod
+    def common_hop_subsequence(treevecs, compute_seq=False):
+        """
+        Longest common hop subsequence of a set of trees, computed segment by
+        segment with a multi-sequence LCS (see LCS1.multi_lcs); for two trees
+        it has the length of hop_similarity
+        Input:
+        - treevecs (list(TreeVec)): k >= 1 trees on the same leaves order
+        - compute_seq (bool): if True, returns the subsequence
+        Output:
+        - compute_seq=False: (int) number of internal nodes common to all trees
+          in the subsequence
+        - compute_seq=True: list((label,bool)) as in hop_similarity
+        """
+        vectors = [treevec.vector for treevec in treevecs]
+        starts = [0] * len(vectors)
+        lcs_len, lcs_seq = 0, []
+        while starts[0] < len(vectors[0]):
+            # Segment of every vector ending with the next leaf
+            segments, ends = [], []
+            for v,i in zip(vectors, starts):
+                j = i
+                while not v[j][3]:
+                    j += 1
+                segments.append([frozenset(v[k][0]) for k in range(i,j)])
+                ends.append(j)
+            if all(segments):
+                lcs = multi_lcs(segments)
+                lcs_len += len(lcs)
+                if compute_seq:
+                    lcs_seq += [(x,False) for x in lcs]
+            if compute_seq:
+                lcs_seq.append((vectors[0][ends[0]][0],True))
+            starts = [j+1 for j in ends]
+        return (lcs_seq if compute_seq else lcs_len)
@@ -0,0 +1,90 @@
+from time import perf_counter
+import threading
+
+class Profiler:
+    """
+    Instrumentation of the hot paths of TreeVec: tree2treevec, treevec2tree and
+    hop_similarity.
+
+    Data structure
+    - timings (dict str -> float): phase -> cumulated time in seconds
+    - counters (dict str -> int): counter -> value
+    - histograms (dict str -> dict int -> int): histogram -> value -> count
+
+    Profiling is off unless a profiler is enabled with enable(); when it is off
+    the instrumented functions only test that the active profiler is None.
+    Updates are serialized by a lock, so a profiler can be shared by threads.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def add_time(self, phase, start):
+        """
+        Add to phase the time elapsed since start (perf_counter value)
+        Output:
+        - (float): current perf_counter value, to chain phases
+        """
+        now = perf_counter()
+        with self.lock:
+            self.timings[phase] = self.timings.get(phase, 0.0) + now - start
+        return now
+
+    def count(self, counter, k=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + k
+
+    def record(self, histogram, value):
+        with self.lock:
+            h = self.histograms.setdefault(histogram, {})
+            h[value] = h.get(value, 0) + 1
+
+    def as_dict(self):
+        """
+        Output:
+        - (dict): {"timings": ..., "counters": ..., "histograms": ...}, histogram
+          values sorted increasingly
+        """
+        with self.lock:
+            return {
+                "timings": dict(self.timings),
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: {value: h[value] for value in sorted(h)}
+                    for name, h in self.histograms.items()
+                }
+            }
+
+# Active profiler, None when profiling is off
+PROFILER = None
+
+def enable():
+    """
+    Start profiling with a new profiler
+    Output:
+    - (Profiler)
+    """
+    global PROFILER
+    PROFILER = Profiler()
+    return PROFILER
+
+def disable():
+    """
+    Stop profiling
+    Output:
+    - (Profiler): the profiler that was active, None if profiling was off
+    """
+    global PROFILER
+    profiler, PROFILER = PROFILER, None
+    return profiler
+
+def get_profile():
+    """
+    Output:
+    - (dict): data of the active profiler (see Profiler.as_dict), empty if
+      profiling is off
+    """
+    return {} if PROFILER is None else PROFILER.as_dict()
@@ -0,0 +1,259 @@
+from ete3 import Tree
+from ete3.parser.newick import NewickError
+from nonbinary import TreeVec
+from treeseq import read_trees
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+import socketserver
+import argparse
+import heapq
+import json
+import os
+import socket
+import threading
+
+# Errors caused by a request, answered with status 400; any other error is
+# answered with status 500
+CLIENT_ERRORS = (KeyError, IndexError, ValueError, TypeError, NewickError, OSError)
+# Paths of the operations answered by handle
+OPERATIONS = ["/load", "/drop", "/collections", "/similarity", "/distance", "/topk", "/batch"]
+
+class TreeStore:
+    """
+    Named collections of trees kept in memory
+
+    Data structure
+    - collections (dict str -> (dict str -> int, list(TreeVec))): name ->
+      (leaf2idx, trees)
+    """
+
+    def __init__(self):
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def load(self, name, newick_strs, leaf2idx):
+        """
+        Convert and store a collection, replacing any collection with the same
+        name
+        Output:
+        - (int): number of trees
+        """
+        trees = [
+            TreeVec(tree=Tree(newick_str, format=1), leaf2idx=leaf2idx)
+            for newick_str in newick_strs
+        ]
+        with self.lock:
+            self.collections[name] = (leaf2idx, trees)
+        return len(trees)
+
+    def drop(self, name):
+        with self.lock:
+            del self.collections[name]
+
+    def get(self, name):
+        """
+        Output:
+        - (dict str -> int, list(TreeVec)): KeyError if there is no such
+          collection
+        """
+        with self.lock:
+            if name not in self.collections:
+                raise KeyError(f"Unknown collection {name}")
+            return self.collections[name]
+
+    def sizes(self):
+        with self.lock:
+            return {name: len(trees) for name, (_, trees) in self.collections.items()}
+
+def _tree(ref, leaf2idx, trees):
+    """
+    Tree given in a request: an index in the collection or a Newick string;
+    TypeError for any other JSON value, including booleans
+    """
+    if isinstance(ref, bool) or not isinstance(ref, (int, str)):
+        raise TypeError(f"Tree reference {ref!r} is neither an index nor a Newick string")
+    if isinstance(ref, int):
+        return trees[ref]
+    return TreeVec(tree=Tree(ref, format=1), leaf2idx=leaf2idx)
+
+def handle(store, path, request):
+    """
+    Answer a request
+    Input:
+    - store (TreeStore)
+    - path (str): operation
+      - /load: {"name", "leaf2idx", "newick": [str] or "file": str} ->
+        {"trees": int}
+      - /drop: {"name"} -> {}
+      - /collections: {} -> {"collections": {name: number of trees}}
+      - /similarity, /distance: {"collection", "trees": [ref,ref]} ->
+        {"similarity" or "distance": int}
+      - /topk: {"collection", "query": ref, "k": int} -> {"neighbors":
+        [[index, distance]]}, the k trees closest to the query, by increasing
+        distance
+      - /batch: {"collection", "pairs": [[ref,ref]], "metric": "similarity" or
+        "distance"} -> {"values": [int]}
+      A tree ref is the index of a tree in the collection or a Newick string.
+    - request (dict): decoded JSON body
+    Output:
+    - (dict): JSON answer; an error in CLIENT_ERRORS on bad requests
+    """
+    if path not in OPERATIONS:
+        raise KeyError(f"Unknown operation {path}")
+    if path == "/load":
+        if "file" in request:
+            newick_strs = read_trees(request["file"])
+        else:
+            newick_strs = request["newick"]
+        return {"trees": store.load(request["name"], newick_strs, request["leaf2idx"])}
+    if path == "/drop":
+        store.drop(request["name"])
+        return {}
+    if path == "/collections":
+        return {"collections": store.sizes()}
+    leaf2idx, trees = store.get(request["collection"])
+    if path in ["/similarity", "/distance"]:
+        t1, t2 = [_tree(ref, leaf2idx, trees) for ref in request["trees"]]
+        if path == "/similarity":
+            return {"similarity": t1.hop_similarity(t2)}
+        return {"distance": t1.hop_distance(t2)}
+    if path == "/topk":
+        query = _tree(request["query"], leaf2idx, trees)
+        neighbors = heapq.nsmallest(
+            request["k"],
+            ((query.hop_distance(trees[i]), i) for i in range(0,len(trees)))
+        )
+        return {"neighbors": [[i, d] for d, i in neighbors]}
+    if path == "/batch":
+        metric = request.get("metric", "similarity")
+        if metric not in ["similarity", "distance"]:
+            raise ValueError(f"Unknown metric {metric}")
+        # keyed by type too, as True == 1 in a dict
+        cache, values = {}, []
+        for ref1, ref2 in request["pairs"]:
+            for ref in [ref1, ref2]:
+                if (type(ref), ref) not in cache:
+                    cache[(type(ref), ref)] = _tree(ref, leaf2idx, trees)
+            t1, t2 = cache[(type(ref1), ref1)], cache[(type(ref2), ref2)]
+            if metric == "similarity":
+                values.append(t1.hop_similarity(t2))
+            else:
+                values.append(t1.hop_distance(t2))
+        return {"values": values}
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    POST requests with a JSON body, answered by a worker of the server pool;
+    GET /collections is also accepted
+    """
+
+    def do_GET(self):
+        self.__answer({})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as error:
+            self.__send(400, {"error": f"Invalid JSON: {error}"})
+            return
+        self.__answer(request)
+
+    def __answer(self, request):
+        future = self.server.executor.submit(
+            handle, self.server.store, self.path, request
+        )
+        try:
+            answer = future.result()
+        except CLIENT_ERRORS as error:
+            self.__send(400, {"error": f"{type(error).__name__}: {error}"})
+        except Exception as error:
+            self.__send(500, {"error": f"{type(error).__name__}: {error}"})
+        else:
+            self.__send(200, answer)
+
+    def __send(self, status, answer):
+        body = json.dumps(answer).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+class Server(ThreadingHTTPServer):
+    """
+    HTTP comparison server on localhost or on a Unix socket. Connections are
+    served by threads, and comparisons run on a pool of worker threads that
+    bounds the number of concurrent requests.
+
+    Data structure
+    - store (TreeStore)
+    - executor (ThreadPoolExecutor)
+    """
+    daemon_threads = True
+
+    def __init__(self, address, store=None, workers=None, verbose=False):
+        """
+        Input:
+        - address ((str,int) or str): (host, port), or path of a Unix socket
+        - store (TreeStore): if None an empty store
+        - workers (int): size of the worker pool, if None os.cpu_count()
+        - verbose (bool): log every request
+        """
+        if isinstance(address, str):
+            self.address_family = socket.AF_UNIX
+            if os.path.exists(address):
+                os.remove(address)
+        self.store = TreeStore() if store is None else store
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.verbose = verbose
+        super().__init__(address, Handler)
+
+    def server_bind(self):
+        if self.address_family == socket.AF_UNIX:
+            socketserver.TCPServer.server_bind(self)
+            self.server_name, self.server_port = "localhost", 0
+        else:
+            super().server_bind()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+        if self.address_family == socket.AF_UNIX and os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Tree comparison server keeping collections of trees in memory"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", type=str, default=None, help="Listen on a Unix socket")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--load", type=str, nargs=3, action="append", default=[],
+        metavar=("NAME", "FILE", "LEAF2IDX"),
+        help="Load a collection at startup: one Newick tree per line in FILE"
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    store = TreeStore()
+    for name, file_path, leaf2idx_path in args.load:
+        with open(leaf2idx_path, 'r', encoding='utf-8') as file:
+            leaf2idx = json.load(file)
+        store.load(name, read_trees(file_path), leaf2idx)
+    address = args.unix if args.unix is not None else (args.host, args.port)
+    with Server(address, store=store, workers=args.workers, verbose=args.verbose) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
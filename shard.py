@@ -0,0 +1,241 @@
+from ete3 import Tree
+from nonbinary import TreeVec
+from treeseq import read_trees
+from batch import hop_distances
+from allpairs import distance_dtype, write_metadata, write_done, _blocks
+import numpy as np
+import argparse
+import json
+import os
+
+# All-pairs work units cover the upper part of the matrix; one-vs-many work
+# units cover ranges of trees compared to a query tree
+MODES = ["all", "one"]
+
+def _job_path(job_dir):
+    return os.path.join(job_dir, "job.json")
+
+def _unit_path(job_dir, unit_id, suffix=".json"):
+    return os.path.join(job_dir, "units", f"unit-{unit_id:06d}{suffix}")
+
+def _result_path(job_dir, unit_id):
+    return os.path.join(job_dir, "results", f"unit-{unit_id:06d}.npy")
+
+def read_job(job_dir):
+    """
+    Output:
+    - (dict): description of the job
+      - file (str): one Newick tree per line
+      - leaf2idx (dict str -> int)
+      - num_trees (int)
+      - mode (str): in MODES
+      - query (str): Newick string of the query tree, one-vs-many mode only
+      - dtype (str)
+      - block_size (int)
+      - num_units (int)
+    """
+    with open(_job_path(job_dir), 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def read_unit(job_dir, unit_id):
+    """
+    Output:
+    - (dict): {"id": int, "rows": [r0,r1], "cols": [c0,c1]}, trees r0 to r1-1
+      against trees c0 to c1-1 (the query in one-vs-many mode)
+    """
+    with open(_unit_path(job_dir, unit_id), 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def plan(file_path, leaf2idx, job_dir, block_size=1024, query=None):
+    """
+    Split the hop distance computation over the trees of a file into work
+    units, each stored in its own file of job_dir, to be processed by workers
+    sharing the file system
+    Input:
+    - file_path (str): one Newick tree per line, read by the workers
+    - leaf2idx (dict str -> int)
+    - job_dir (str): created if needed
+    - block_size (int): side of an all-pairs block, or number of trees per
+      one-vs-many unit
+    - query (str): Newick string; if None all-pairs distances, otherwise
+      distances of every tree to the query
+    Output:
+    - (int): number of units
+    """
+    N = sum(1 for _ in read_trees(file_path))
+    if query is None:
+        units = _blocks(range(0,N), range(0,N), block_size)
+    else:
+        units = [[r0, min(r0+block_size, N), -1, 0] for r0 in range(0,N,block_size)]
+    os.makedirs(os.path.join(job_dir, "units"), exist_ok=True)
+    os.makedirs(os.path.join(job_dir, "results"), exist_ok=True)
+    for unit_id, (r0,r1,c0,c1) in enumerate(units):
+        with open(_unit_path(job_dir, unit_id), 'w', encoding='utf-8') as file:
+            json.dump({"id": unit_id, "rows": [r0,r1], "cols": [c0,c1]}, file)
+    job = {
+        "file": os.path.abspath(file_path), "leaf2idx": leaf2idx, "num_trees": N,
+        "mode": "all" if query is None else "one", "query": query,
+        "dtype": distance_dtype(len(leaf2idx)).name, "block_size": block_size,
+        "num_units": len(units)
+    }
+    write_metadata(os.path.join(job_dir, "job"), job)
+    return len(units)
+
+def _claim(job_dir, unit_id):
+    """
+    Claim a unit by creating its lock file, atomic on a shared file system
+    Output:
+    - (bool): False if the unit is claimed by another worker
+    """
+    try:
+        fd = os.open(_unit_path(job_dir, unit_id, ".lock"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.write(fd, f"{os.uname().nodename} {os.getpid()}\n".encode())
+    os.close(fd)
+    return True
+
+def process_unit(job_dir, unit_id, job=None, processes=1):
+    """
+    Compute a unit and store its distances in results/; only the trees of the
+    unit are converted. The result is written atomically, so a unit has a
+    result file only once it is complete.
+    Output:
+    - (numpy.ndarray): rows x cols distances
+    """
+    if job is None:
+        job = read_job(job_dir)
+    unit = read_unit(job_dir, unit_id)
+    r0, r1 = unit["rows"]
+    c0, c1 = unit["cols"]
+    leaf2idx = job["leaf2idx"]
+    needed = set(range(r0,r1)) | set(range(c0,c1))
+    trees = {}
+    for i, newick_str in enumerate(read_trees(job["file"])):
+        if i in needed:
+            trees[i] = TreeVec(tree=Tree(newick_str, format=1), leaf2idx=leaf2idx)
+    if job["mode"] == "one":
+        trees[-1] = TreeVec(tree=Tree(job["query"], format=1), leaf2idx=leaf2idx)
+        cols = [-1]
+    else:
+        cols = range(c0,c1)
+    distances = np.array(
+        hop_distances(trees, range(r0,r1), cols, processes=processes),
+        dtype=job["dtype"]
+    )
+    tmp_path = _result_path(job_dir, unit_id) + ".tmp.npy"
+    np.save(tmp_path, distances)
+    os.replace(tmp_path, _result_path(job_dir, unit_id))
+    return distances
+
+def work(job_dir, processes=1):
+    """
+    Process the units of a job that are neither claimed nor done, until there
+    is none left; several workers can run at once on any nodes
+    Output:
+    - (list(int)): units processed by this worker
+    """
+    job = read_job(job_dir)
+    processed = []
+    for unit_id in range(0,job["num_units"]):
+        if os.path.exists(_result_path(job_dir, unit_id)) or not _claim(job_dir, unit_id):
+            continue
+        process_unit(job_dir, unit_id, job=job, processes=processes)
+        processed.append(unit_id)
+    return processed
+
+def status(job_dir):
+    """
+    Output:
+    - (dict): {"done": [int], "running": [int], "todo": [int]}; a unit is
+      running if it is claimed without result, which may be a dead worker:
+      remove units/unit-ID.lock to make it available again
+    """
+    job = read_job(job_dir)
+    result = {"done": [], "running": [], "todo": []}
+    for unit_id in range(0,job["num_units"]):
+        if os.path.exists(_result_path(job_dir, unit_id)):
+            result["done"].append(unit_id)
+        elif os.path.exists(_unit_path(job_dir, unit_id, ".lock")):
+            result["running"].append(unit_id)
+        else:
+            result["todo"].append(unit_id)
+    return result
+
+def merge(job_dir, path):
+    """
+    Assemble the results of a completed job
+    Input:
+    - path (str): all-pairs mode: matrix file in the format of
+      allpairs.all_pairs, readable with allpairs.open_matrix; one-vs-many mode:
+      .npy file of the distances to the query
+    Output:
+    - (numpy.ndarray or numpy.memmap)
+    """
+    job = read_job(job_dir)
+    todo = [u for u in range(0,job["num_units"]) if not os.path.exists(_result_path(job_dir, u))]
+    if todo:
+        raise ValueError(f"{len(todo)} units are not done, first {todo[0]}")
+    N = job["num_trees"]
+    if job["mode"] == "one":
+        distances = np.zeros(N, dtype=job["dtype"])
+        for unit_id in range(0,job["num_units"]):
+            r0, r1 = read_unit(job_dir, unit_id)["rows"]
+            distances[r0:r1] = np.load(_result_path(job_dir, unit_id))[:,0]
+        np.save(path, distances)
+        return distances
+    matrix = np.memmap(path, dtype=job["dtype"], mode="w+", shape=(N,N))
+    done = []
+    for unit_id in range(0,job["num_units"]):
+        unit = read_unit(job_dir, unit_id)
+        r0, r1 = unit["rows"]
+        c0, c1 = unit["cols"]
+        block = np.load(_result_path(job_dir, unit_id))
+        matrix[r0:r1, c0:c1] = block
+        matrix[c0:c1, r0:r1] = block.T
+        done.append([r0,r1,c0,c1])
+    matrix.flush()
+    write_done(path, done)
+    write_metadata(path, {
+        "num_trees": N, "dtype": job["dtype"], "block_size": job["block_size"]
+    })
+    return matrix
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Hop distance jobs split into work units on a shared file system"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    plan_parser = subparsers.add_parser("plan", help="Write the work units of a job")
+    plan_parser.add_argument("file", type=str, help="File with one Newick tree per line")
+    plan_parser.add_argument("leaf2idx", type=str, help="JSON file: leaf name -> index (1-base)")
+    plan_parser.add_argument("job_dir", type=str)
+    plan_parser.add_argument("--block-size", type=int, default=1024)
+    plan_parser.add_argument(
+        "--query", type=str, default=None,
+        help="Newick string: distances of every tree to this tree instead of all pairs"
+    )
+    work_parser = subparsers.add_parser("work", help="Process available units")
+    work_parser.add_argument("job_dir", type=str)
+    work_parser.add_argument("--unit", type=int, default=None, help="Process this unit only")
+    work_parser.add_argument("--processes", type=int, default=1)
+    status_parser = subparsers.add_parser("status", help="Print done, running and todo units")
+    status_parser.add_argument("job_dir", type=str)
+    merge_parser = subparsers.add_parser("merge", help="Assemble the results")
+    merge_parser.add_argument("job_dir", type=str)
+    merge_parser.add_argument("output", type=str)
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        with open(args.leaf2idx, 'r', encoding='utf-8') as file:
+            leaf2idx = json.load(file)
+        print(plan(args.file, leaf2idx, args.job_dir, block_size=args.block_size, query=args.query))
+    elif args.command == "work":
+        if args.unit is not None:
+            process_unit(args.job_dir, args.unit, processes=args.processes)
+        else:
+            work(args.job_dir, processes=args.processes)
+    elif args.command == "status":
+        print(json.dumps(status(args.job_dir)))
+    else:
+        merge(args.job_dir, args.output)
@@ -0,0 +1,288 @@
+from nonbinary import TreeVec
+from LIS import LIS_len
+from array import array
+from multiprocessing import shared_memory
+import numpy as np
+
+# Type code of the integer arrays stored in shared memory
+TYPECODE = "q"
+ITEMSIZE = array(TYPECODE).itemsize
+
+def vector_segments(vector):
+    """
+    Segments of a tree vector representation, the form in which trees of a
+    SharedTreeCollection are compared
+    Input:
+    - vector (list): TreeVec.vector
+    Output:
+    - list(list(tuple(int))): segment[i] = sorted labels of the internal nodes
+      between leaf i and the previous leaf, in vector order
+    """
+    segments, segment = [], []
+    for x in vector:
+        if x[3]:
+            segments.append(segment)
+            segment = []
+        else:
+            segment.append(tuple(sorted(x[0])))
+    return segments
+
+def segments_similarity(segments1, segments2):
+    """
+    Hop similarity of two trees given by their segments (see vector_segments),
+    equal to TreeVec.hop_similarity
+    Output:
+    - (int)
+    """
+    similarity = 0
+    for segment1,segment2 in zip(segments1, segments2):
+        if len(segment1) > 0 and len(segment2) > 0:
+            map1 = {segment1[i1]: i1 for i1 in range(0,len(segment1))}
+            similarity += LIS_len([map1[x] for x in segment2 if x in map1])
+    return similarity
+
+class SharedTreeCollection:
+    """
+    Collection of tree vector representations stored in a single
+    multiprocessing.shared_memory block, so that worker processes attach to it
+    by name instead of receiving pickled vectors.
+
+    Only the labels and leaf flags of the vectors are stored (no names nor
+    branch lengths). For T trees with E vector entries in total and L integers
+    in their labels, the block contains, in this order:
+    - tree_offsets (T+1 int64): entries of tree i are tree_offsets[i] to
+      tree_offsets[i+1]-1
+    - label_offsets (E+1 int64): integers of the label of entry e are
+      label_offsets[e] to label_offsets[e+1]-1
+    - label_values (L int64): leaf labels, and sorted internal node labels
+    - leaf (E bytes): 1 if the entry is a leaf (second occurrence), 0 otherwise
+
+    Pickling a collection only pickles the name of its block and its sizes;
+    unpickling attaches to the block.
+    """
+
+    def __init__(self, shm, num_trees, num_entries, num_values, owner):
+        """
+        Use SharedTreeCollection.from_treevecs or SharedTreeCollection.attach
+        """
+        self.shm = shm
+        self.num_trees = num_trees
+        self.num_entries = num_entries
+        self.num_values = num_values
+        self.owner = owner
+        buf = shm.buf
+        a = (num_trees+1) * ITEMSIZE
+        b = a + (num_entries+1) * ITEMSIZE
+        c = b + num_values * ITEMSIZE
+        self.tree_offsets = buf[0:a].cast(TYPECODE)
+        self.label_offsets = buf[a:b].cast(TYPECODE)
+        self.label_values = buf[b:c].cast(TYPECODE)
+        self.leaf = buf[c:c+num_entries]
+
+    @staticmethod
+    def from_treevecs(treevecs):
+        """
+        Copy a collection of tree representations into a new shared memory block
+        Input:
+        - treevecs (iterable(TreeVec))
+        Output:
+        - (SharedTreeCollection): owner of the block, to be released with
+          close() and unlink(), or used as a context manager
+        """
+        tree_offsets, label_offsets = array(TYPECODE, [0]), array(TYPECODE, [0])
+        label_values, leaf = array(TYPECODE), bytearray()
+        for treevec in treevecs:
+            for x in treevec.vector:
+                if x[3]:
+                    label_values.append(x[0])
+                else:
+                    label_values.extend(sorted(x[0]))
+                label_offsets.append(len(label_values))
+                leaf.append(1 if x[3] else 0)
+            tree_offsets.append(len(leaf))
+        num_trees, num_entries = len(tree_offsets)-1, len(leaf)
+        size = (
+            (len(tree_offsets) + len(label_offsets) + len(label_values)) * ITEMSIZE
+            + num_entries
+        )
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        collection = SharedTreeCollection(
+            shm, num_trees, num_entries, len(label_values), True
+        )
+        collection.tree_offsets[:] = tree_offsets
+        collection.label_offsets[:] = label_offsets
+        collection.label_values[:] = label_values
+        collection.leaf[:] = leaf
+        return collection
+
+    @property
+    def spec(self):
+        """
+        Output:
+        - (tuple): (block name, number of trees, of entries, of label values),
+          argument of SharedTreeCollection.attach
+        """
+        return (self.shm.name, self.num_trees, self.num_entries, self.num_values)
+
+    @staticmethod
+    def attach(spec, validate=False):
+        """
+        Attach to the shared memory block of an existing collection
+        Input:
+        - spec (tuple): see SharedTreeCollection.spec
+        - validate (bool): if True, raise ValueError if a tree is invalid (see
+          invalid_trees)
+        Output:
+        - (SharedTreeCollection): not owner of the block
+        """
+        name, num_trees, num_entries, num_values = spec
+        collection = SharedTreeCollection(
+            shared_memory.SharedMemory(name=name), num_trees, num_entries,
+            num_values, False
+        )
+        if validate:
+            invalid = collection.invalid_trees()
+            if len(invalid) > 0:
+                collection.close()
+                raise ValueError(f"{len(invalid)} invalid trees, first {invalid[0]}")
+        return collection
+
+    def invalid_trees(self):
+        """
+        Check the encoding invariants of every tree (see TreeVec.validate) with
+        vectorized operations on the shared arrays, in time linear in their size
+        Output:
+        - (numpy.ndarray): indices of the invalid trees, increasing
+        """
+        T, E = self.num_trees, self.num_entries
+        tree_offsets = np.frombuffer(self.tree_offsets, dtype=np.int64)
+        label_offsets = np.frombuffer(self.label_offsets, dtype=np.int64)
+        values = np.frombuffer(self.label_values, dtype=np.int64)
+        leaf = np.frombuffer(self.leaf, dtype=np.uint8).astype(bool)
+        sizes = np.diff(tree_offsets)
+        invalid = sizes == 0
+        # tree of every entry, and label j of the leaf ending its segment
+        tree = np.repeat(np.arange(T), sizes)
+        leaves = np.cumsum(leaf)
+        first = tree_offsets[:-1]
+        before = np.concatenate(([0], leaves))[first]
+        n_tree = np.concatenate(([0], leaves))[tree_offsets[1:]] - before
+        j = leaves - leaf - before[tree] + 1
+        num_values = np.diff(label_offsets)
+        # Leaves: a single value, equal to j
+        bad = leaf & (num_values != 1)
+        ok_leaf = leaf & ~bad
+        bad[ok_leaf] |= values[label_offsets[:-1][ok_leaf]] != j[ok_leaf]
+        # Internal nodes: non-empty label; the last entry is a leaf
+        bad |= ~leaf & (num_values == 0)
+        nonempty = sizes > 0
+        last = tree_offsets[1:][nonempty] - 1
+        invalid[np.flatnonzero(nonempty)[~leaf[last]]] = True
+        # Root: internal node labeled {1}
+        root = first[nonempty]
+        root_bad = leaf[root] | (num_values[root] != 1)
+        root_bad[~root_bad] = values[label_offsets[root[~root_bad]]] != 1
+        invalid[np.flatnonzero(nonempty)[root_bad]] = True
+        invalid[tree[bad]] = True
+        # Values of internal node labels: in (j,n] except for the root, and every
+        # value of 1 to n exactly once per tree
+        owner = np.repeat(np.arange(E), num_values)
+        internal = ~leaf[owner]
+        owner, internal_values = owner[internal], values[internal]
+        is_root = np.zeros(E, dtype=bool)
+        is_root[root] = True
+        owner_tree = tree[owner]
+        out = (
+            (internal_values > n_tree[owner_tree])
+            | ((internal_values <= j[owner]) & ~is_root[owner])
+            | (internal_values < 1)
+        )
+        invalid[owner_tree[out]] = True
+        keep = ~out
+        base = np.concatenate(([0], np.cumsum(n_tree)))
+        counts = np.bincount(
+            base[owner_tree[keep]] + internal_values[keep] - 1,
+            minlength=int(base[-1])
+        )
+        value_tree = np.repeat(np.arange(T), n_tree)
+        invalid[value_tree[counts != 1]] = True
+        return np.flatnonzero(invalid)
+
+    def __reduce__(self):
+        return (SharedTreeCollection.attach, (self.spec,))
+
+    def __len__(self):
+        return self.num_trees
+
+    def __getitem__(self, i):
+        """
+        Tree representation of tree i, decoded from the shared arrays
+        Output:
+        - (TreeVec): names are None and branch lengths 0.0
+        """
+        if i < 0:
+            i += self.num_trees
+        if not 0 <= i < self.num_trees:
+            raise IndexError(f"tree index {i} out of range")
+        label_offsets, label_values, leaf = (
+            self.label_offsets, self.label_values, self.leaf
+        )
+        v = []
+        for e in range(self.tree_offsets[i], self.tree_offsets[i+1]):
+            if leaf[e]:
+                v.append([label_values[label_offsets[e]], None, 0.0, True])
+            else:
+                v.append([
+                    set(label_values[label_offsets[e]:label_offsets[e+1]]),
+                    None, 0.0, False
+                ])
+        return TreeVec(treevec_vec=v)
+
+    def segments(self, i):
+        """
+        Segments of tree i (see vector_segments), read from the shared arrays
+        without decoding the tree
+        Output:
+        - list(list(tuple(int)))
+        """
+        if i < 0:
+            i += self.num_trees
+        if not 0 <= i < self.num_trees:
+            raise IndexError(f"tree index {i} out of range")
+        label_offsets, label_values, leaf = (
+            self.label_offsets, self.label_values, self.leaf
+        )
+        segments, segment = [], []
+        for e in range(self.tree_offsets[i], self.tree_offsets[i+1]):
+            if leaf[e]:
+                segments.append(segment)
+                segment = []
+            else:
+                segment.append(tuple(label_values[label_offsets[e]:label_offsets[e+1]]))
+        return segments
+
+    def __iter__(self):
+        for i in range(0,self.num_trees):
+            yield self[i]
+
+    def close(self):
+        """
+        Release the views on the block and detach from it
+        """
+        for view in [self.tree_offsets, self.label_offsets, self.label_values, self.leaf]:
+            view.release()
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Destroy the block; only the owner of the collection should call it
+        """
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        if self.owner:
+            self.unlink()
@@ -0,0 +1,133 @@
+from hashlib import blake2b
+import numpy as np
+import random
+
+# Modulus of the hash functions h(x) = (a*x+b) mod PRIME, x < PRIME
+PRIME = (1 << 31) - 1
+# Number of tokens hashed at once when building a sketch
+CHUNK_SIZE = 1 << 13
+
+def hash_functions(num_hashes, seed=0):
+    """
+    Coefficients of num_hashes universal hash functions
+    Output:
+    - (numpy.ndarray,numpy.ndarray): a and b, int64 arrays
+    """
+    rng = random.Random(seed)
+    a = np.array([rng.randrange(1, PRIME) for _ in range(0,num_hashes)], dtype=np.int64)
+    b = np.array([rng.randrange(0, PRIME) for _ in range(0,num_hashes)], dtype=np.int64)
+    return a, b
+
+def tokens(treevec):
+    """
+    Tokens of a tree vector representation: one per internal node, the pair
+    (label of the leaf ending its segment, label), hashed to [0,PRIME)
+    independently of the Python hash seed
+    Output:
+    - (numpy.ndarray): int64
+    """
+    result, segment = [], []
+    for x in treevec.vector:
+        if x[3]:
+            for label in segment:
+                key = f"{x[0]}:{','.join(map(str, sorted(label)))}".encode()
+                h = int.from_bytes(blake2b(key, digest_size=8).digest(), "little")
+                result.append(h % PRIME)
+            segment = []
+        else:
+            segment.append(x[0])
+    return np.array(result, dtype=np.int64)
+
+class Sketch:
+    """
+    MinHash sketch of the segments of a tree vector representation.
+
+    Two trees on the same leaves order have a hop similarity at most their
+    number of common tokens (see tokens), as an LCS only contains internal
+    nodes with the same label in the same segment. With J the Jaccard index
+    of the token sets, estimated by the fraction of equal signature values,
+    the number of common tokens is J/(1+J) x (m1+m2) for m1 and m2 tokens.
+
+    Error bounds, for k hash functions: the estimate of J is unbiased with
+    standard deviation sqrt(J(1-J)/k) <= 1/(2 sqrt(k)), and by Hoeffding's
+    inequality P(|estimate - J| >= eps) <= 2 exp(-2 k eps^2); for k = 128,
+    |estimate - J| < 0.12 with probability 0.95. The error on the similarity
+    bound is at most (m1+m2) times the error on J, since the derivative
+    1/(1+J)^2 of J/(1+J) is between 1/4 and 1.
+
+    Data structure
+    - signature (numpy.ndarray): k minimum hash values (PRIME if no token)
+    - num_tokens (int): number of internal nodes
+    - num_hashes (int), seed: sketches are comparable if built with the same
+      values
+    """
+
+    def __init__(self, treevec, num_hashes=128, seed=0):
+        """
+        Sketch a tree in O(m k) time for m internal nodes and k hash functions
+        """
+        self.num_hashes = num_hashes
+        self.seed = seed
+        a, b = hash_functions(num_hashes, seed=seed)
+        x = tokens(treevec)
+        self.num_tokens = len(x)
+        self.signature = np.full(num_hashes, PRIME, dtype=np.int64)
+        for i in range(0,len(x),CHUNK_SIZE):
+            values = (np.outer(a, x[i:i+CHUNK_SIZE]) + b[:,None]) % PRIME
+            np.minimum(self.signature, values.min(axis=1), out=self.signature)
+
+    def jaccard(self, other):
+        """
+        Estimate of the Jaccard index of the token sets, in O(k)
+        """
+        if self.num_hashes != other.num_hashes or self.seed != other.seed:
+            raise ValueError("Sketches built with different hash functions")
+        if self.num_tokens == 0 and other.num_tokens == 0:
+            return 1.0
+        return float(np.mean(self.signature == other.signature))
+
+    def similarity_bound(self, other):
+        """
+        Estimate of the number of common tokens, an upper bound of the hop
+        similarity up to the estimation error
+        """
+        j = self.jaccard(other)
+        return j / (1+j) * (self.num_tokens + other.num_tokens)
+
+    def distance_bound(self, other):
+        """
+        Estimate of a lower bound of the hop distance (see
+        TreeVec.hop_distance), to discard distant pairs before exact comparison
+        """
+        return max(self.num_tokens, other.num_tokens) - self.similarity_bound(other)
+
+def lsh_candidates(sketches, bands):
+    """
+    Candidate similar pairs by locality-sensitive hashing: signatures are cut
+    into bands of k/bands values and two sketches are candidates if they are
+    equal on a band. A pair with Jaccard index J is a candidate with
+    probability 1-(1-J^r)^bands for r = k/bands values per band; the threshold
+    where this probability is about 1/2 is (1/bands)^(1/r).
+    Input:
+    - sketches (list(Sketch)): built with the same hash functions
+    - bands (int): divisor of the number of hash functions
+    Output:
+    - set((int,int)): pairs (i,j), i < j, of indices in sketches
+    """
+    if not sketches:
+        return set()
+    k = sketches[0].num_hashes
+    if k % bands != 0:
+        raise ValueError(f"{bands} bands do not divide {k} hash functions")
+    r = k // bands
+    candidates = set()
+    for band in range(0,bands):
+        buckets = {}
+        for i, sketch in enumerate(sketches):
+            key = sketch.signature[band*r:(band+1)*r].tobytes()
+            buckets.setdefault(key, []).append(i)
+        for bucket in buckets.values():
+            for p in range(0,len(bucket)):
+                for q in range(p+1,len(bucket)):
+                    candidates.add((bucket[p], bucket[q]))
+    return candidates
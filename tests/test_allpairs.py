@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pytest
+
+import allpairs
+from allpairs import all_pairs, extend_all_pairs, read_metadata
+from nonbinary import TreeVec
+
+@pytest.fixture
+def trees():
+    return list(TreeVec.random_collection(30, 40, polytomy_rate=0.3, seed=2))
+
+def _expected(trees):
+    return [[t1.hop_distance(t2) for t2 in trees] for t1 in trees]
+
+class Interrupt(Exception):
+    pass
+
+def test_all_pairs(tmp_path, trees):
+    path = str(tmp_path / "m.bin")
+    matrix = all_pairs(trees, path, block_size=7, processes=1, backend="thread")
+    assert matrix.tolist() == _expected(trees)
+    assert not os.path.exists(path + ".done.tmp")
+
+def test_resume(tmp_path, trees, monkeypatch):
+    path = str(tmp_path / "m.bin")
+    append_done = allpairs.append_done
+    calls = []
+
+    def interrupted(path, block):
+        append_done(path, block)
+        calls.append(block)
+        if len(calls) == 3:
+            raise Interrupt()
+
+    monkeypatch.setattr(allpairs, "append_done", interrupted)
+    with pytest.raises(Interrupt):
+        all_pairs(trees[:20], path, block_size=4, processes=1, backend="thread")
+    monkeypatch.setattr(allpairs, "append_done", append_done)
+    # a line cut by the interruption is ignored
+    with open(path + ".done", 'a', encoding='utf-8') as file:
+        file.write("1 2")
+    assert read_metadata(path)["done"] == calls
+    matrix = all_pairs(trees[:20], path, block_size=4, processes=1, backend="thread")
+    assert matrix.tolist() == _expected(trees[:20])
+    assert len(read_metadata(path)["done"]) == 15
+
+def test_extend(tmp_path, trees):
+    path = str(tmp_path / "m.bin")
+    all_pairs(trees[:20], path, block_size=4, processes=1, backend="thread")
+    matrix = extend_all_pairs(trees, path, processes=1, backend="thread")
+    assert matrix.tolist() == _expected(trees)
+    assert "extend" not in read_metadata(path)
+
+def test_extend_resume_overlapping_row(tmp_path, trees, monkeypatch):
+    # With 20 then 30 trees, row 1 overlaps its destination: the move is
+    # interrupted after corrupting the row in place, and must be redone from
+    # the journal
+    path = str(tmp_path / "m.bin")
+    all_pairs(trees[:20], path, block_size=4, processes=1, backend="thread")
+    write_metadata = allpairs.write_metadata
+
+    def interrupted(path, metadata):
+        write_metadata(path, metadata)
+        if metadata.get("extend", {}).get("journal") == 1:
+            flat = np.memmap(path, dtype=metadata["dtype"], mode="r+", shape=(30*30,))
+            flat[30:50] = 255
+            flat.flush()
+            raise Interrupt()
+
+    monkeypatch.setattr(allpairs, "write_metadata", interrupted)
+    with pytest.raises(Interrupt):
+        extend_all_pairs(trees, path, processes=1, backend="thread")
+    monkeypatch.setattr(allpairs, "write_metadata", write_metadata)
+    assert read_metadata(path)["extend"]["journal"] == 1
+    matrix = extend_all_pairs(trees, path, processes=1, backend="thread")
+    assert matrix.tolist() == _expected(trees)
+    assert not os.path.exists(path + ".row.npy")
+
+def test_extend_resume_blocks(tmp_path, trees, monkeypatch):
+    path = str(tmp_path / "m.bin")
+    all_pairs(trees[:20], path, block_size=4, processes=1, backend="thread")
+    append_done = allpairs.append_done
+    calls = []
+
+    def interrupted(path, block):
+        append_done(path, block)
+        calls.append(block)
+        if len(calls) == 2:
+            raise Interrupt()
+
+    monkeypatch.setattr(allpairs, "append_done", interrupted)
+    with pytest.raises(Interrupt):
+        extend_all_pairs(trees, path, processes=1, backend="thread")
+    monkeypatch.setattr(allpairs, "append_done", append_done)
+    with pytest.raises(ValueError, match="being extended"):
+        all_pairs(trees, path, block_size=4, processes=1, backend="thread")
+    matrix = extend_all_pairs(trees, path, processes=1, backend="thread")
+    assert matrix.tolist() == _expected(trees)
+
+def test_mismatch(tmp_path, trees):
+    path = str(tmp_path / "m.bin")
+    all_pairs(trees[:20], path, block_size=4, processes=1, backend="thread")
+    with pytest.raises(ValueError, match="extend_all_pairs"):
+        all_pairs(trees, path, block_size=4, processes=1, backend="thread")
+    with pytest.raises(ValueError, match="block size 4"):
+        all_pairs(trees[:20], path, block_size=5, processes=1, backend="thread")
+    matrix = all_pairs(trees, path, block_size=5, processes=1, backend="thread", overwrite=True)
+    assert matrix.tolist() == _expected(trees)
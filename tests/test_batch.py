@@ -0,0 +1,17 @@
+import pytest
+
+from batch import hop_distances, hop_similarities, one_vs_many
+from nonbinary import TreeVec
+from shared import SharedTreeCollection
+
+@pytest.mark.parametrize("processes,backend", [(1, "process"), (2, "thread"), (2, "process")])
+def test_shared_comparisons_as_treevec(processes, backend):
+    trees = list(TreeVec.random_collection(12, 25, polytomy_rate=0.3, seed=5))
+    pairs = [(i,j) for i in range(0,len(trees)) for j in range(i,len(trees))]
+    with SharedTreeCollection.from_treevecs(trees) as collection:
+        similarities = hop_similarities(collection, pairs, processes=processes, backend=backend)
+        distances = hop_distances(collection, range(0,4), range(0,12), processes=processes, backend=backend)
+        query = one_vs_many(trees[3], collection, processes=processes, backend=backend)
+    assert similarities == [trees[i].hop_similarity(trees[j]) for i,j in pairs]
+    assert distances == [[trees[i].hop_distance(trees[j]) for j in range(0,12)] for i in range(0,4)]
+    assert query == [trees[3].hop_similarity(tree) for tree in trees]
@@ -0,0 +1,56 @@
+import os
+
+import cache
+from cache import TreeCache, load_trees
+from nonbinary import TreeVec
+
+LEAF2IDX = {"A": 1, "B": 2, "C": 3}
+
+def _load(cache_dir, content, calls, max_bytes=None):
+    def convert():
+        calls.append(content)
+        return [TreeVec(treevec_vec=[[{1}, None, 0.0, False], [1, "A", 1.0, True]])]
+    return TreeCache(cache_dir, max_bytes=max_bytes).load(content, LEAF2IDX, convert)
+
+def test_hit_and_miss(tmp_path):
+    calls = []
+    first = _load(str(tmp_path), b"x", calls)
+    assert _load(str(tmp_path), b"x", calls)[0].vector == first[0].vector
+    assert calls == [b"x"]
+    _load(str(tmp_path), b"y", calls)
+    assert calls == [b"x", b"y"]
+    assert TreeCache.key(b"x", LEAF2IDX) != TreeCache.key(b"x", {"A": 2, "B": 1, "C": 3})
+
+def test_load_errors_are_misses(tmp_path, monkeypatch):
+    calls = []
+    _load(str(tmp_path), b"x", calls)
+    path = tmp_path / (TreeCache.key(b"x", LEAF2IDX) + ".pkl")
+    path.write_bytes(b"corrupted")
+    _load(str(tmp_path), b"x", calls)
+    assert calls == [b"x", b"x"]
+    # an entry written by another version is a miss
+    assert TreeCache(str(tmp_path)).get(path.stem) is not None
+    monkeypatch.setattr(cache, "FORMAT_VERSION", cache.FORMAT_VERSION + 1)
+    assert TreeCache(str(tmp_path)).get(path.stem) is None
+
+def test_eviction(tmp_path):
+    calls = []
+    _load(str(tmp_path), b"a", calls)
+    size = os.path.getsize(tmp_path / (TreeCache.key(b"a", LEAF2IDX) + ".pkl"))
+    _load(str(tmp_path), b"b", calls)
+    os.utime(tmp_path / (TreeCache.key(b"a", LEAF2IDX) + ".pkl"), (0, 0))
+    os.utime(tmp_path / (TreeCache.key(b"b", LEAF2IDX) + ".pkl"), (1, 1))
+    # "a" is the least recently used entry
+    _load(str(tmp_path), b"c", calls, max_bytes=2*size)
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        TreeCache.key(content, LEAF2IDX) + ".pkl" for content in [b"b", b"c"]
+    )
+
+def test_load_trees(tmp_path):
+    path = tmp_path / "trees.nwk"
+    path.write_text("((A,B),C);\n\n(A,(B,C));\n", encoding="utf-8")
+    directory = TreeCache(str(tmp_path / "cache"))
+    uncached = load_trees(str(path), LEAF2IDX)
+    assert [t.vector for t in load_trees(str(path), LEAF2IDX, cache=directory)] == [t.vector for t in uncached]
+    assert [t.vector for t in load_trees(str(path), LEAF2IDX, cache=directory)] == [t.vector for t in uncached]
+    assert len(os.listdir(tmp_path / "cache")) == 1
@@ -0,0 +1,48 @@
+import pytest
+from ete3 import Tree
+
+from nexus import load_nexus, read_translate
+from nonbinary import TreeVec
+
+NEWICKS = [
+    "((1:1,2:1):1,(3:1,4:1):1);",
+    "((1:1,3:1):1,(2:1,4:1):1);",
+    "(((1:1,2:1):1,3:1):1,4:1);",
+    "((1:1,4:1):1,2:1,3:1);",
+    "((2:1,3:1):1,(1:1,4:1):1);",
+]
+NAMES = {"1": "Homo sapiens", "2": "Pan", "3": "it's", "4": "Gorilla,gorilla"}
+
+@pytest.fixture
+def nexus_file(tmp_path):
+    path = tmp_path / "trees.nex"
+    lines = [
+        "#NEXUS", "begin trees;", "\ttranslate",
+        "\t\t1 'Homo sapiens',", "\t\t2 Pan,", "\t\t3 'it''s',", '\t\t4 "Gorilla,gorilla"', "\t\t;",
+    ]
+    for i in range(0,len(NEWICKS)):
+        lines.append(f"tree STATE_{i} [&lnP=-{i}.5] = [&R] {NEWICKS[i]}")
+    lines.append("end;")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+def _expected(newick_str, leaf2idx):
+    tree = Tree(newick_str, format=1)
+    for leaf in tree.iter_leaves():
+        leaf.name = NAMES[leaf.name]
+    return TreeVec(tree=tree, leaf2idx=leaf2idx).vector
+
+def test_read_translate(nexus_file):
+    assert read_translate(nexus_file) == NAMES
+    assert list(read_translate(nexus_file)) == ["1", "2", "3", "4"]
+
+@pytest.mark.parametrize("burnin,thin,kept", [
+    (0, 1, [0, 1, 2, 3, 4]), (2, 1, [2, 3, 4]), (0.2, 2, [1, 3]), (1, 3, [1, 4]),
+])
+@pytest.mark.parametrize("processes", [1, 2])
+def test_load_nexus(nexus_file, burnin, thin, kept, processes):
+    leaf2idx, trees = load_nexus(
+        nexus_file, burnin=burnin, thin=thin, processes=processes, chunksize=1
+    )
+    assert leaf2idx == {"Homo sapiens": 1, "Pan": 2, "it's": 3, "Gorilla,gorilla": 4}
+    assert [t.vector for t in trees] == [_expected(NEWICKS[i], leaf2idx) for i in kept]
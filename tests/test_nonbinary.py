@@ -0,0 +1,212 @@
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from ete3 import Tree
+
+import nonbinary
+from nonbinary import TreeVec
+
+def _key(vector):
+    return tuple(x[0] if x[3] else frozenset(x[0]) for x in vector)
+
+@pytest.mark.parametrize("seed", range(0,30))
+def test_restrict_as_ete3_prune(seed):
+    rng = random.Random(seed)
+    treevec = next(TreeVec.random_collection(1, 15, polytomy_rate=0.3, seed=seed))
+    # entry 1 is the root, whose branch length is not written in Newick
+    for x in treevec.vector[2:]:
+        x[2] = round(rng.random(), 6)
+    leaf2idx = treevec.leaf_labels()
+    kept = rng.sample(sorted(leaf2idx), rng.randint(2,14))
+    restricted = treevec.restrict(kept)
+    tree = Tree(treevec.treevec2newick(), format=1)
+    tree.prune(kept, preserve_branch_length=True)
+    order = sorted(kept, key=lambda leaf: leaf2idx[leaf])
+    expected = TreeVec(tree=tree, leaf2idx={order[i]: i+1 for i in range(0,len(order))})
+    assert _key(restricted.vector) == _key(expected.vector)
+    assert [x[2] for x in restricted.vector] == pytest.approx([x[2] for x in expected.vector])
+    assert restricted.leaf_labels() == expected.leaf_labels()
+
+
+@pytest.mark.parametrize("seed", range(0,20))
+def test_relabel_as_reconversion(seed):
+    rng = random.Random(seed)
+    treevec = next(TreeVec.random_collection(1, 12, polytomy_rate=0.3, seed=seed))
+    leaves = sorted(treevec.leaf_labels())
+    rng.shuffle(leaves)
+    leaf2idx = {leaves[i]: i+1 for i in range(0,len(leaves))}
+    relabeled = treevec.relabel(leaf2idx)
+    expected = TreeVec(tree=Tree(treevec.treevec2newick(), format=1), leaf2idx=leaf2idx)
+    assert _key(relabeled.vector) == _key(expected.vector)
+    assert relabeled.leaf_labels() == leaf2idx
+    assert treevec.relabel(treevec.leaf_labels()) is treevec
+
+def test_relabel_collection_as_relabel():
+    rng = random.Random(0)
+    leaves = [str(i) for i in range(1,11)]
+    treevecs = []
+    for treevec in TreeVec.random_collection(10, 10, seed=1):
+        rng.shuffle(leaves)
+        treevecs.append(treevec.relabel({leaves[i]: i+1 for i in range(0,len(leaves))}))
+    leaf2idx = treevecs[0].leaf_labels()
+    relabeled = TreeVec.relabel_collection(treevecs, leaf2idx)
+    assert relabeled[0] is treevecs[0]
+    for treevec, result in zip(treevecs, relabeled):
+        assert _key(result.vector) == _key(treevec.relabel(leaf2idx).vector)
+
+@pytest.mark.parametrize("seed", range(0,20))
+def test_newick_round_trip(seed):
+    rng = random.Random(seed)
+    treevec = next(TreeVec.random_collection(1, 15, polytomy_rate=0.3, seed=seed))
+    # entry 1 is the root, whose branch length is not written in Newick
+    for p in range(2,len(treevec.vector)):
+        treevec.vector[p][2] = round(rng.random(), 6)
+        if not treevec.vector[p][3] and rng.random() < 0.5:
+            treevec.vector[p][1] = f"n{p}"
+    newick_str = treevec.treevec2newick()
+    tree = Tree(newick_str, format=1)
+    result = TreeVec(tree=tree, leaf2idx=treevec.leaf_labels())
+    assert _key(result.vector) == _key(treevec.vector)
+    assert [x[2] for x in result.vector[2:]] == pytest.approx([x[2] for x in treevec.vector[2:]])
+    # internal node names are written, but not read back by tree2treevec
+    assert sorted(node.name for node in tree.traverse() if not node.is_leaf() and node.name) == sorted(
+        x[1] for x in treevec.vector if not x[3] and isinstance(x[1], str)
+    )
+    assert result.treevec2newick() == re.sub(r"\)n\d+", ")", newick_str)
+
+def test_random_valid_and_reproducible():
+    for n in [1, 2, 3, 10, 50]:
+        for polytomy_rate in [0.0, 0.5]:
+            for treevec in TreeVec.random_collection(20, n, polytomy_rate=polytomy_rate, seed=n):
+                treevec.validate()
+                if polytomy_rate == 0.0:
+                    # n-1 internal nodes and the added root
+                    assert sum(1 for x in treevec.vector if not x[3]) == n
+    collection = [_key(t.vector) for t in TreeVec.random_collection(10, 20, polytomy_rate=0.3, seed=7)]
+    assert collection == [_key(t.vector) for t in TreeVec.random_collection(10, 20, polytomy_rate=0.3, seed=7)]
+    assert collection != [_key(t.vector) for t in TreeVec.random_collection(10, 20, polytomy_rate=0.3, seed=8)]
+
+def test_random_binary_uniform():
+    # 15 rooted binary trees on 4 leaves
+    counts = {}
+    for treevec in TreeVec.random_collection(15000, 4, seed=0):
+        key = _key(treevec.vector)
+        counts[key] = counts.get(key, 0) + 1
+    assert len(counts) == 15
+    assert all(800 < count < 1200 for count in counts.values())
+
+@pytest.mark.parametrize("compute_seq", [False, True])
+def test_parallel_hop_similarity_as_serial(compute_seq, monkeypatch):
+    monkeypatch.setattr(nonbinary, "PARALLEL_MIN_ENTRIES", 1)
+    t1, t2 = TreeVec.random_collection(2, 200, polytomy_rate=0.3, seed=6)
+    serial = t1.hop_similarity(t2, compute_seq=compute_seq)
+    assert t1.hop_similarity(t2, compute_seq=compute_seq, processes=3) == serial
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        for _ in range(0,2):
+            assert t1.hop_similarity(
+                t2, compute_seq=compute_seq, processes=3, executor=executor
+            ) == serial
+
+@pytest.mark.parametrize("seed", range(0,10))
+def test_iter_lcs_as_compute_seq(seed):
+    t1, t2 = TreeVec.random_collection(2, 30, polytomy_rate=0.3*(seed%2), seed=seed)
+    expected = t1.hop_similarity(t2, compute_seq=True)
+    assert list(t1.iter_lcs(t2)) == expected
+    positions = list(t1.iter_lcs(t2, positions=True))
+    assert [(t1.vector[p][0], t1.vector[p][3]) for p in positions] == expected
+    lcs_positions, leaf_bits = t1.compact_lcs(t2)
+    assert list(lcs_positions) == positions
+    assert [bool(leaf_bits[k >> 3] >> (k & 7) & 1) for k in range(0,len(positions))] == [
+        is_leaf for _, is_leaf in expected
+    ]
+
+@pytest.mark.parametrize("seed", range(0,8))
+def test_hop_neighbors_brute_force(seed):
+    treevec = next(TreeVec.random_collection(1, 7, polytomy_rate=0.3*(seed%2), seed=seed))
+    neighbors = []
+    for p, q, vector in treevec.hop_neighbors():
+        assert _key(vector) == _key(treevec.hop_move(p,q).vector)
+        neighbor = TreeVec(treevec_vec=list(vector))
+        neighbor.validate()
+        assert treevec.hop_distance(neighbor) == 1
+        neighbors.append(_key(vector))
+    assert len(neighbors) == len(set(neighbors))
+    # every move of every internal entry to every position it can hop to
+    expected = set()
+    v = treevec.vector
+    for p in range(1,len(v)):
+        if v[p][3]:
+            continue
+        for q in range(1,len(v)):
+            try:
+                moved = treevec.hop_move(p,q)
+                moved.validate()
+            except ValueError:
+                continue
+            if _key(moved.vector) != _key(v):
+                expected.add(_key(moved.vector))
+    assert set(neighbors) == expected
+
+def test_random_hop_moves_uniform():
+    treevec = next(TreeVec.random_collection(1, 6, seed=3))
+    neighbors = {_key(vector) for _, _, vector in treevec.hop_neighbors()}
+    counts = {}
+    for p, q in treevec.random_hop_moves(20000, random.Random(1)):
+        key = _key(treevec.hop_move(p,q).vector)
+        counts[key] = counts.get(key, 0) + 1
+    assert set(counts) == neighbors
+    mean = 20000 / len(neighbors)
+    assert all(0.8*mean < count < 1.2*mean for count in counts.values())
+
+@pytest.mark.parametrize("seed", range(0,5))
+def test_names_free_conversion(seed):
+    treevec = next(TreeVec.random_collection(1, 20, polytomy_rate=0.3, seed=seed))
+    tree = Tree(treevec.treevec2newick(), format=1)
+    newick_str = tree.write(format=1)
+    named = TreeVec(tree=tree, leaf2idx=treevec.leaf_labels())
+    unnamed = TreeVec(tree=tree, leaf2idx=treevec.leaf_labels(), names=False)
+    # the input tree is not modified
+    assert tree.write(format=1) == newick_str
+    assert all(x[1] is None for x in unnamed.vector if not x[3])
+    assert _key(unnamed.vector) == _key(named.vector)
+    assert unnamed.simvec == named.simvec
+    assert unnamed.simvec == [x[1] for x in named.vector]
+    assert unnamed.hop_distance(named) == 0
+
+@pytest.mark.parametrize("vector, message", [
+    ([], "root"),
+    ([[{1}]], "expected \\[label, name, dist, is_leaf\\]"),
+    ([[{1}, None, 0.0, False], [1, "1", 1.0, "yes"]], "is_leaf must be a bool"),
+    ([[{1}, None, 0.0, False], [1, "1", 1.0, True], [{2}, None, 1.0, False]], "last entry"),
+    ([[{1}, None, 0.0, False], [2, "1", 1.0, True]], "expected leaf 1"),
+    ([[{1}, None, 0.0, False], [1, "1", 1.0, True], [{2}, None, 1.0, False],
+      [2, "2", 1.0, True]], "not in \\(2,2\\]"),
+    ([[{1}, None, 0.0, False], [{2}, None, 1.0, False], [{2}, None, 1.0, False],
+      [1, "1", 1.0, True], [2, "2", 1.0, True]], "appears twice"),
+    ([[{1}, None, 0.0, False], [1, "1", 1.0, True], [2, "2", 1.0, True]], "in no internal"),
+])
+def test_validate_errors(vector, message):
+    with pytest.raises(ValueError, match=message):
+        TreeVec(treevec_vec=vector).validate()
+
+def test_validate_valid():
+    for treevec in TreeVec.random_collection(20, 30, polytomy_rate=0.3, seed=4):
+        treevec.validate()
+
+def _is_subsequence(seq, vector):
+    entries = iter((x[0], x[3]) for x in vector)
+    return all(any(entry == x for entry in entries) for x in seq)
+
+@pytest.mark.parametrize("seed", range(0,10))
+def test_common_hop_subsequence(seed):
+    t1, t2, t3 = TreeVec.random_collection(3, 20, polytomy_rate=0.3*(seed%2), seed=seed)
+    assert TreeVec.common_hop_subsequence([t1, t2]) == t1.hop_similarity(t2)
+    seq = TreeVec.common_hop_subsequence([t1, t2, t3], compute_seq=True)
+    assert all(_is_subsequence(seq, t.vector) for t in [t1, t2, t3])
+    assert sum(1 for _, is_leaf in seq if not is_leaf) == TreeVec.common_hop_subsequence([t1, t2, t3])
+    assert TreeVec.common_hop_subsequence([t1, t2, t3]) <= min(
+        t1.hop_similarity(t2), t1.hop_similarity(t3), t2.hop_similarity(t3)
+    )
+    assert TreeVec.common_hop_subsequence([t1, t1, t1]) == t1.hop_similarity(t1)
@@ -0,0 +1,29 @@
+import pytest
+
+from server import TreeStore, handle
+
+@pytest.fixture
+def store():
+    store = TreeStore()
+    handle(store, "/load", {
+        "name": "c", "leaf2idx": {"A": 1, "B": 2, "C": 3},
+        "newick": ["((A,B),C);", "(A,(B,C));"],
+    })
+    return store
+
+def test_operations(store):
+    assert handle(store, "/collections", {}) == {"collections": {"c": 2}}
+    assert handle(store, "/distance", {"collection": "c", "trees": [0, "(A,(B,C));"]}) == {"distance": 1}
+    assert handle(store, "/batch", {"collection": "c", "pairs": [[0, 0], [0, 1]]}) == {"values": [3, 2]}
+    assert handle(store, "/topk", {"collection": "c", "query": 1, "k": 1}) == {"neighbors": [[1, 0]]}
+
+def test_unknown_operation(store):
+    with pytest.raises(KeyError, match="Unknown operation /nope"):
+        handle(store, "/nope", {})
+
+@pytest.mark.parametrize("ref", [True, False, 1.0, None, [0]])
+def test_invalid_refs(store, ref):
+    with pytest.raises(TypeError):
+        handle(store, "/similarity", {"collection": "c", "trees": [0, ref]})
+    with pytest.raises(TypeError):
+        handle(store, "/batch", {"collection": "c", "pairs": [[1, 1], [ref, 0]]})
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import shard
+from allpairs import open_matrix
+from nonbinary import TreeVec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _write_trees(tmp_path, count, n, seed):
+    trees = list(TreeVec.random_collection(count, n, polytomy_rate=0.3, seed=seed))
+    file_path = tmp_path / "trees.nwk"
+    file_path.write_text("".join(t.treevec2newick() + "\n" for t in trees))
+    return trees, str(file_path), {str(i): i for i in range(1,n+1)}
+
+def test_workers_then_merge(tmp_path):
+    trees, file_path, leaf2idx = _write_trees(tmp_path, 23, 30, seed=1)
+    job_dir = str(tmp_path / "job")
+    assert shard.plan(file_path, leaf2idx, job_dir, block_size=5) == 15
+    workers = [
+        subprocess.Popen([sys.executable, os.path.join(ROOT, "shard.py"), "work", job_dir])
+        for _ in range(0,3)
+    ]
+    assert all(worker.wait() == 0 for worker in workers)
+    assert shard.status(job_dir) == {"done": list(range(0,15)), "running": [], "todo": []}
+    # every unit is claimed by exactly one worker
+    locks = os.listdir(os.path.join(job_dir, "units"))
+    assert len([name for name in locks if name.endswith(".lock")]) == 15
+    shard.merge(job_dir, str(tmp_path / "m.bin"))
+    matrix = open_matrix(str(tmp_path / "m.bin"))
+    expected = [[t1.hop_distance(t2) for t2 in trees] for t1 in trees]
+    assert matrix.tolist() == expected
+
+def test_one_vs_many(tmp_path):
+    trees, file_path, leaf2idx = _write_trees(tmp_path, 11, 20, seed=2)
+    job_dir = str(tmp_path / "job")
+    shard.plan(file_path, leaf2idx, job_dir, block_size=4, query=trees[3].treevec2newick())
+    assert shard.work(job_dir) == [0, 1, 2]
+    distances = shard.merge(job_dir, str(tmp_path / "q.npy"))
+    assert distances.tolist() == [trees[3].hop_distance(t) for t in trees]
+    assert np.load(str(tmp_path / "q.npy")).tolist() == distances.tolist()
+
+def test_merge_incomplete(tmp_path):
+    _, file_path, leaf2idx = _write_trees(tmp_path, 6, 10, seed=3)
+    job_dir = str(tmp_path / "job")
+    shard.plan(file_path, leaf2idx, job_dir, block_size=2)
+    shard.process_unit(job_dir, 0)
+    with pytest.raises(ValueError, match="5 units are not done"):
+        shard.merge(job_dir, str(tmp_path / "m.bin"))
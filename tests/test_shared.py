@@ -0,0 +1,50 @@
+import copy
+import random
+
+from nonbinary import TreeVec
+from shared import SharedTreeCollection
+
+def _corrupt(treevec, rng):
+    """
+    Copy of a tree with one random change of its vector, which may or may not
+    break an encoding invariant
+    """
+    v = copy.deepcopy(treevec.vector)
+    internal = [p for p in range(1,len(v)) if not v[p][3]]
+    leaves = [p for p in range(0,len(v)) if v[p][3]]
+    k = rng.randrange(7)
+    if k == 0:
+        p = rng.choice(internal)
+        v[p][0] = set(v[p][0]) | {max(v[p][0]) + 100}
+    elif k == 1:
+        p, q = rng.choice(internal), rng.choice(internal)
+        v[p][0] = set(v[p][0]) | set(v[q][0]) if p != q else set()
+    elif k == 2:
+        x = v.pop(rng.choice(internal))
+        v.insert(rng.randrange(1,len(v)), x)
+    elif k == 3:
+        v[0][0] = {2}
+    elif k == 4:
+        v = v[:-1]
+    elif k == 5:
+        a, b = rng.sample(leaves, 2)
+        v[a], v[b] = v[b], v[a]
+    else:
+        p = rng.choice(internal)
+        v[p][0] = set(v[p][0]) - {min(v[p][0])}
+    return TreeVec(treevec_vec=v)
+
+def test_invalid_trees_as_validate():
+    rng = random.Random(0)
+    trees = []
+    for i, treevec in enumerate(TreeVec.random_collection(300, 30, polytomy_rate=0.3, seed=2)):
+        trees.append(_corrupt(treevec, rng) if i % 3 == 0 else treevec)
+    expected = []
+    for i in range(0,len(trees)):
+        try:
+            trees[i].validate()
+        except ValueError:
+            expected.append(i)
+    assert expected
+    with SharedTreeCollection.from_treevecs(trees) as collection:
+        assert collection.invalid_trees().tolist() == expected
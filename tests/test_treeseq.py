@@ -0,0 +1,43 @@
+import random
+
+import pytest
+from ete3 import Tree
+
+from nonbinary import TreeVec
+from treeseq import tree_sequence
+
+def _key(vector):
+    return [(x[0] if x[3] else frozenset(x[0]), x[1], x[2], x[3]) for x in vector]
+
+def _move(tree, rng):
+    nodes = [x for x in tree.traverse() if not x.is_root()]
+    moved = rng.choice(nodes)
+    if rng.random() < 0.3:
+        moved.dist = round(rng.random(), 3)
+        return
+    parent = moved.up
+    moved.detach()
+    if len(parent.children) == 1:
+        if not parent.is_root():
+            parent.delete()
+        elif not parent.children[0].is_leaf():
+            child = parent.children[0].detach()
+            for x in list(child.children):
+                parent.add_child(x.detach())
+    targets = [x for x in tree.traverse() if not x.is_leaf()]
+    rng.choice(targets).add_child(moved)
+
+@pytest.mark.parametrize("seed", range(0,20))
+@pytest.mark.parametrize("names", [True, False])
+def test_tree_sequence_as_full_conversion(seed, names):
+    rng = random.Random(seed)
+    n = rng.randint(3,20)
+    tree = Tree(next(TreeVec.random_collection(1, n, seed=seed)).treevec2newick(), format=1)
+    newick_strs = [tree.write(format=1)]
+    for _ in range(0,15):
+        _move(tree, rng)
+        newick_strs.append(tree.write(format=1))
+    leaf2idx = {str(i): i for i in range(1,n+1)}
+    for newick_str, treevec in zip(newick_strs, tree_sequence(newick_strs, leaf2idx, names=names)):
+        expected = TreeVec(tree=Tree(newick_str, format=1), leaf2idx=leaf2idx, names=names)
+        assert _key(treevec.vector) == _key(expected.vector)
@@ -0,0 +1,288 @@
+from ete3 import Tree
+from nonbinary import TreeVec
+import argparse
+import json
+import re
+
+# Parentheses of a Newick string
+PARENS = re.compile(r"[()]")
+# End of the text of a node, followed by its next sibling or by its parent
+SEPARATOR = re.compile(r"[,)]")
+# Leaf names, following "(" or ","
+LEAF = re.compile(r"[(,]([^(),:;]+)")
+# Name and branch length of a node, as read by ete3 in format 1
+NODE_DATA = re.compile(r"^([^():,;\[\]]*?)(?::\s*([+-]?\d+\.?\d*(?:[eE][-+]?\d+)?)\s*)?$")
+
+def read_trees(file_path):
+    """
+    Read an ordered sequence of trees, one Newick string per line
+    Input:
+    - file_path (str)
+    Output:
+    - generator of (str): Newick strings, in file order, blank lines skipped
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield line
+
+def newick_index(newick_str):
+    """
+    Index of a Newick string
+    Output:
+    - (dict int -> int, dict str -> int): position of "(" -> position of the
+      matching ")", and leaf name -> position; None if the parentheses are not
+      balanced
+    """
+    leaf_position = {match.group(1): match.start(1) for match in LEAF.finditer(newick_str)}
+    close, stack = {}, []
+    for match in PARENS.finditer(newick_str):
+        p = match.start()
+        if newick_str[p] == "(":
+            stack.append(p)
+        elif not stack:
+            return None
+        else:
+            close[stack.pop()] = p
+    return None if stack else (close, leaf_position)
+
+def _node_data(text, default_dist=1.0):
+    """
+    Output:
+    - (str,float): name and branch length of a node text name:dist, None if it
+      is malformed
+    """
+    match = NODE_DATA.match(text)
+    if match is None:
+        return None
+    dist = default_dist if match.group(2) is None else float(match.group(2))
+    return match.group(1), dist
+
+def leaf_positions(treevec):
+    """
+    Output:
+    - list(int): position[i] = position of leaf i in the vector, position[0] = 0
+      (the added root); segment i is vector[position[i-1]+1:position[i]]
+    """
+    v = treevec.vector
+    return [0] + [p for p in range(0,len(v)) if v[p][3]]
+
+def patch(previous, previous_str, previous_index, positions, newick_str, index,
+          leaf2idx, idx2leaf, names=True):
+    """
+    Compute the vector of a tree from the vector of a tree differing by local
+    changes, such as a subtree move, without converting the whole tree.
+    A node is unchanged if its Newick text, which includes its subtree, is the
+    text of a node of the previous tree; the other nodes, the ancestors of the
+    changes, are the only ones parsed and labeled. The segments emitted again
+    are those of the smallest leaf of every child of a changed node: a
+    segment of another leaf lies in an unchanged subtree, and its entries are
+    shared with the previous vector, as the bottom part of the emitted
+    segments.
+    Input:
+    - previous (TreeVec): vector of the previous tree, converted with leaf2idx
+    - previous_str (str): Newick string of the previous tree
+    - previous_index: newick_index(previous_str)
+    - positions (list(int)): leaf positions of previous (see leaf_positions)
+    - newick_str (str): Newick string of the tree, format=1, on the same leaves
+    - index: newick_index(newick_str), not None
+    - leaf2idx (dict str -> int), idx2leaf (dict int -> str)
+    - names (bool): see TreeVec.tree2treevec
+    Output:
+    - (TreeVec): None if newick_str is not a tree on the leaves of previous
+      with the same syntax (it is then to be converted from scratch)
+    """
+    s, old = newick_str, previous_str
+    close, leaf_position = index
+    old_close, old_leaf_position = previous_index
+    if not s.startswith("(") or not s.endswith(";"):
+        return None
+
+    def __unchanged(start, end):
+        # As leaf names are unique, the node can only be the node of old at
+        # the same offset from its first leaf
+        leaf = LEAF.search(s, start-1, end)
+        if leaf is None or leaf.group(1) not in old_leaf_position:
+            return False
+        q = old_leaf_position[leaf.group(1)] - (leaf.start(1) - start)
+        if q < 1 or old[q-1] not in "(,":
+            return False
+        if old[q] == "(":
+            if q not in old_close:
+                return False
+            old_end = SEPARATOR.search(old, old_close[q]+1).start()
+        else:
+            old_end = SEPARATOR.search(old, q).start()
+        return old_end-q == end-start and old[q:old_end] == s[start:end]
+
+    # Changed nodes in preorder: parenthesis positions, parent, branch length
+    # and children; a child is ("C", changed node), ("U", unchanged subtree
+    # start, end) or ("L", changed leaf name, branch length)
+    nodes = [[0, close[0], None, None, []]]
+    data = _node_data(s[close[0]+1:-1], default_dist=0.0)
+    if data is None:
+        return None
+    nodes[0][3] = data[1]
+    k = 0
+    while k < len(nodes):
+        open_pos, close_pos, _, _, children = nodes[k]
+        start = open_pos+1
+        while start <= close_pos:
+            if s[start] == "(":
+                if start not in close:
+                    return None
+                end = SEPARATOR.search(s, close[start]+1).start()
+            else:
+                end = SEPARATOR.search(s, start).start()
+            if __unchanged(start, end):
+                children.append(("U", start, end))
+            elif s[start] == "(":
+                data = _node_data(s[close[start]+1:end])
+                if data is None:
+                    return None
+                children.append(("C", len(nodes)))
+                nodes.append([start, close[start], k, data[1], []])
+            else:
+                data = _node_data(s[start:end])
+                if data is None:
+                    return None
+                children.append(("L", data[0], data[1]))
+            start = end+1
+        k += 1
+    # Smallest leaf of every child, checking that the leaves are those of the
+    # previous tree
+    leaves = []
+    children_min = [[] for _ in range(0,len(nodes))]
+    for k in range(0,len(nodes)):
+        for child in nodes[k][4]:
+            if child[0] == "U":
+                child_leaves = LEAF.findall(s, child[1]-1, child[2])
+            elif child[0] == "L":
+                child_leaves = [child[1]]
+            else:
+                children_min[k].append(None)
+                continue
+            if not all(leaf in leaf2idx for leaf in child_leaves):
+                return None
+            child_leaves = list(map(leaf2idx.__getitem__, child_leaves))
+            leaves += child_leaves
+            children_min[k].append(min(child_leaves))
+    if len(leaves) != len(positions)-1 or len(set(leaves)) != len(leaves):
+        return None
+    # Labeling the changed nodes in postorder
+    min_label, node_label = [None] * len(nodes), [None] * len(nodes)
+    for k in range(len(nodes)-1, -1, -1):
+        for j, child in enumerate(nodes[k][4]):
+            if child[0] == "C":
+                children_min[k][j] = min_label[child[1]]
+        min_label[k] = min(children_min[k])
+        node_label[k] = set(children_min[k]).difference({min_label[k]})
+
+    def __name(label):
+        return {idx2leaf[i] for i in label} if names else None
+
+    v = previous.vector
+    segments = {}
+    for k in range(0,len(nodes)):
+        for j, child in enumerate(nodes[k][4]):
+            if child[0] == "C":
+                continue
+            i = children_min[k][j]
+            if child[0] == "U":
+                # The nodes of the unchanged subtree above leaf i end the previous
+                # segment i
+                q = leaf_position[idx2leaf[i]]
+                depth = s.count("(", child[1], q) - s.count(")", child[1], q)
+                bottom = v[positions[i]-depth:positions[i]+1]
+            else:
+                bottom = [[i, child[1], child[2], True]]
+            # Changed ancestors with smallest leaf i, from the top
+            path, x = [], k
+            while x is not None and min_label[x] == i:
+                path.append([node_label[x], __name(node_label[x]), nodes[x][3], False])
+                x = nodes[x][2]
+            segments[i] = path[::-1] + bottom
+    vector, i = v[:1], 1
+    for j in sorted(segments):
+        vector += v[positions[i-1]+1:positions[j-1]+1]
+        vector += segments[j]
+        i = j+1
+    vector += v[positions[i-1]+1:]
+    return TreeVec(treevec_vec=vector)
+
+def tree_sequence(newick_strs, leaf2idx, names=True):
+    """
+    Convert an ordered sequence of trees on the same leaves into vectors, each
+    vector being obtained by patching the previous one (see patch); the first
+    tree is converted from scratch
+    Input:
+    - newick_strs (iterable(str)): Newick strings, format=1
+    - leaf2idx (dict str -> int)
+    - names (bool): see TreeVec.tree2treevec
+    Output:
+    - generator of (TreeVec); only the last vector is kept alive. Consecutive
+      vectors share their unchanged entries, which must not be modified.
+    """
+    idx2leaf = {idx: leaf for leaf,idx in leaf2idx.items()}
+    previous, previous_str, previous_index, positions = None, None, None, None
+    for newick_str in newick_strs:
+        if newick_str != previous_str:
+            index = newick_index(newick_str)
+            treevec = None
+            if previous is not None and previous_index is not None and index is not None:
+                treevec = patch(
+                    previous, previous_str, previous_index, positions, newick_str,
+                    index, leaf2idx, idx2leaf, names=names
+                )
+            if treevec is None:
+                tree = Tree(newick_str, format=1)
+                treevec = TreeVec(tree=tree, leaf2idx=leaf2idx, names=names)
+            previous, previous_str, previous_index = treevec, newick_str, index
+            positions = leaf_positions(treevec)
+        yield previous
+
+def tree_sequence_distances(newick_strs, leaf2idx, reference=None):
+    """
+    Compute the hop distance of each window tree of an ordered sequence of trees
+    either to a reference tree or to the tree of the previous window
+    Input:
+    - newick_strs (iterable(str)): Newick strings, format=1
+    - leaf2idx (dict str -> int)
+    - reference (TreeVec): if None, each tree is compared to the previous one
+      and the first window has distance 0
+    Output:
+    - generator of (int,int): (window index (0-base), hop distance)
+    Memory usage does not depend on the number of windows.
+    """
+    previous = None
+    for window, treevec in enumerate(tree_sequence(newick_strs, leaf2idx, names=False)):
+        if reference is not None:
+            yield window, treevec.hop_distance(reference)
+        elif previous is None or treevec is previous:
+            yield window, 0
+        else:
+            yield window, treevec.hop_distance(previous)
+        previous = treevec
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Hop distances along an ordered sequence of trees"
+    )
+    parser.add_argument("file", type=str, help="File with one Newick tree per line")
+    parser.add_argument("leaf2idx", type=str, help="JSON file: leaf name -> index (1-base)")
+    parser.add_argument(
+        "--reference", type=str, default=None,
+        help="Newick string of a reference tree (default: previous window)"
+    )
+    args = parser.parse_args()
+
+    with open(args.leaf2idx, 'r', encoding='utf-8') as file:
+        leaf2idx = json.load(file)
+    reference = None
+    if args.reference is not None:
+        reference = TreeVec(tree=Tree(args.reference, format=1), leaf2idx=leaf2idx)
+    for window, distance in tree_sequence_distances(
+            read_trees(args.file), leaf2idx, reference=reference
+    ):
+        print(f"{window}\t{distance}")